@@ -1,6 +1,6 @@
 import os
 import re
-import requests
+from http_clients import CLIENTS
 from sheet_manager import SheetManager
 
 def get_telegram_updates(bot_token, offset=None):
@@ -10,7 +10,7 @@ def get_telegram_updates(bot_token, offset=None):
         params["offset"] = offset
     
     try:
-        resp = requests.get(url, params=params, timeout=15)
+        resp = CLIENTS.request("telegram", "GET", url, params=params, timeout=15)
         if resp.status_code == 200:
             return resp.json().get("result", [])
     except Exception as e:
@@ -25,7 +25,7 @@ def send_telegram_message(bot_token, chat_id, text):
         "parse_mode": "Markdown" # 开启 Markdown 以便支持等宽字体
     }
     try:
-        requests.post(url, json=data, timeout=10)
+        CLIENTS.request("telegram", "POST", url, json=data, timeout=10)
     except:
         pass
 
@@ -0,0 +1,150 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import baostock as bs
+import numpy as np
+import pandas as pd
+
+from rate_control import RateController, is_throttle_error
+
+BS_FIELDS = "date,time,open,high,low,close,volume"
+_NUMERIC = ("open", "high", "low", "close", "volume")
+
+
+class BaoStockSession:
+    """
+    One BaoStock login per run, shared by every symbol.
+    The baostock client is a process-wide socket, so all queries are serialized on one lock;
+    a dropped session is detected from the error code / socket error and re-logged in once.
+    """
+
+    def __init__(self, rate: Optional[RateController] = None):
+        self._lock = threading.RLock()
+        self._logged_in = False
+        self._rate = rate
+        self._batch_pool: Optional[ThreadPoolExecutor] = None
+
+    def login(self) -> bool:
+        with self._lock:
+            if self._logged_in:
+                return True
+            lg = bs.login()
+            self._logged_in = lg.error_code == "0"
+            if not self._logged_in:
+                print(f"    [BaoStock] 登录失败: {lg.error_code} {lg.error_msg}", flush=True)
+            return self._logged_in
+
+    def logout(self) -> None:
+        # 先在锁外取消排队中的预取：这些任务都要拿 self._lock，持锁等待它们会死锁；正在执行的那个结束后即可拿到锁
+        pool, self._batch_pool = self._batch_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            if self._logged_in:
+                try:
+                    bs.logout()
+                except Exception:
+                    pass
+                self._logged_in = False
+
+    def _relogin(self) -> bool:
+        self._logged_in = False
+        return self.login()
+
+    def query_bars(self, bs_code: str, tf_min: int, start_date: str, end_date: Optional[str] = None) -> pd.DataFrame:
+        """Minute bars for one code as a typed frame: date (datetime64) + float64 OHLCV."""
+        end_date = end_date or datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            for attempt in (1, 2):
+                if not self.login():
+                    return _empty_frame()
+                if self._rate is not None:
+                    self._rate.acquire()
+                try:
+                    rs = bs.query_history_k_data_plus(
+                        bs_code, BS_FIELDS,
+                        start_date=start_date, end_date=end_date,
+                        frequency=str(tf_min), adjustflag="3"
+                    )
+                except Exception as e:
+                    if self._rate is not None and is_throttle_error(e):
+                        self._rate.on_throttle()
+                    # socket 断开：重新登录后再试一次
+                    if attempt == 1 and self._relogin():
+                        continue
+                    raise e
+                if rs.error_code == "0":
+                    if self._rate is not None:
+                        self._rate.on_success()
+                    return _read_columns(rs)
+                if attempt == 1:
+                    print(f"    [BaoStock] {bs_code} 查询失败 ({rs.error_code} {rs.error_msg})，重新登录重试", flush=True)
+                    self._relogin()
+                    continue
+                print(f"    [BaoStock] {bs_code} 查询失败: {rs.error_code} {rs.error_msg}", flush=True)
+        return _empty_frame()
+
+    def submit_batch(self, jobs: list[tuple[str, int, str, Optional[str]]]) -> dict[tuple, Future]:
+        """
+        Queues jobs on a single background worker and returns a Future per job, so callers can
+        start consuming the first results while the rest of the watchlist is still being queried.
+        """
+        with self._lock:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="baostock")
+            return {job: self._batch_pool.submit(self.query_bars, *job) for job in jobs}
+
+
+def _empty_frame() -> pd.DataFrame:
+    return pd.DataFrame(columns=["date", *_NUMERIC])
+
+
+def _read_columns(rs) -> pd.DataFrame:
+    """
+    Reads the result set page-by-page into typed NumPy columns instead of
+    rs.next()/get_row_data() per row. Falls back to the row API if the page buffer is unavailable.
+    """
+    fields = list(rs.fields)
+    pages = []
+    page = getattr(rs, "data", None)
+    if page is None:
+        rows = []
+        while rs.next(): rows.append(rs.get_row_data())
+        if rows:
+            pages.append(np.asarray(rows, dtype=np.str_))
+    else:
+        while page:
+            pages.append(np.asarray(page, dtype=np.str_))
+            # 跳到本页末尾，next() 会拉取下一页（若有）
+            rs.cur_row_num = len(page)
+            if not rs.next() or rs.data is page:
+                break
+            page = rs.data
+
+    if not pages:
+        return _empty_frame()
+    table = np.concatenate(pages, axis=0) if len(pages) > 1 else pages[0]
+    col = {name: table[:, i] for i, name in enumerate(fields)}
+
+    # time: 'YYYYMMDDHHMMSSsss' -> 'YYYY-MM-DDTHH:MM:SS'，逐字符拼接，全程向量化
+    t = col["time"].astype("U14")
+    ch = t.view("U1").reshape(-1, 14)
+    n = len(t)
+    sep = lambda c: np.full((n, 1), c, dtype="U1")
+    iso = np.concatenate([
+        ch[:, 0:4], sep("-"), ch[:, 4:6], sep("-"), ch[:, 6:8], sep("T"),
+        ch[:, 8:10], sep(":"), ch[:, 10:12], sep(":"), ch[:, 12:14],
+    ], axis=1)
+    iso = np.ascontiguousarray(iso).view("U19").ravel()
+    valid = np.char.str_len(t) == 14
+    dates = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+    dates[valid] = iso[valid].astype("datetime64[s]").astype("datetime64[ns]")
+
+    data = {"date": dates}
+    for name in _NUMERIC:
+        raw = col[name]
+        data[name] = np.where(raw == "", "nan", raw).astype(np.float64)
+    df = pd.DataFrame(data)
+    return df.dropna(subset=["date", "close"]).reset_index(drop=True)
@@ -0,0 +1,95 @@
+from datetime import date
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from trade_calendar import SESSION_MINUTES, TradeCalendar, session_clock, session_minutes
+
+_VALUES = ("open", "high", "low", "close", "volume")
+
+
+class Gap(NamedTuple):
+    start: pd.Timestamp  # 第一根缺失 bar 的结束时间
+    end: pd.Timestamp    # 最后一根缺失 bar 的结束时间
+    bars: int
+    whole_day: bool      # 覆盖完整交易日（多为停牌），补拉也拿不到
+
+
+class BarGrid:
+    """
+    Canonical bar-end timestamps for one timeframe over a range of trading days.
+    A bar's slot is computed arithmetically (day index * bars_per_day + minute slot),
+    so merging sources is a scatter by position rather than concat -> drop_duplicates -> sort,
+    and every slot left empty is an exactly located gap.
+    """
+
+    def __init__(self, cal: TradeCalendar, start_day: date, end_day: date, tf_min: int):
+        self.tf_min = tf_min
+        self.days = np.array(cal.trading_days_between(start_day, end_day), dtype="datetime64[D]")
+        # 1m 包含 AkShare 的 09:30 集合竞价 bar
+        self._first = 0 if tf_min == 1 else tf_min
+        minutes = np.arange(self._first, SESSION_MINUTES + 1, tf_min, dtype=np.int64)
+        self.bars_per_day = len(minutes)
+        self.times = session_clock(np.repeat(self.days, len(minutes)), np.tile(minutes, len(self.days)))
+        self.filled = np.zeros(len(self.times), dtype=bool)
+        self.values = {c: np.full(len(self.times), np.nan) for c in _VALUES}
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def positions(self, dates) -> np.ndarray:
+        """Slot index per timestamp; -1 for timestamps that are not on the grid."""
+        d = np.asarray(dates, dtype="datetime64[ns]")
+        if len(self.days) == 0:
+            return np.full(d.shape, -1, dtype=np.int64)
+        day = d.astype("datetime64[D]")
+        di = np.clip(np.searchsorted(self.days, day), 0, len(self.days) - 1)
+        offset = session_minutes(d) - self._first
+        ok = (self.days[di] == day) & (offset >= 0) & (offset % self.tf_min == 0)
+        return np.where(ok, di * self.bars_per_day + offset // self.tf_min, -1)
+
+    def scatter(self, df: pd.DataFrame, only_missing: bool = False) -> int:
+        """
+        Writes df's bars into their slots (later calls win unless only_missing=True).
+        Returns the number of rows that fell off the grid and were ignored.
+        """
+        if df is None or df.empty:
+            return 0
+        df = df.dropna(subset=["date", "close"])
+        pos = self.positions(df["date"].to_numpy(dtype="datetime64[ns]"))
+        ok = pos >= 0
+        if only_missing:
+            ok &= ~self.filled[np.maximum(pos, 0)]
+        idx = pos[ok]
+        for c in _VALUES:
+            self.values[c][idx] = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=np.float64)[ok]
+        self.filled[idx] = True
+        return int((pos < 0).sum())
+
+    def frame(self) -> pd.DataFrame:
+        """Filled bars in time order."""
+        data = {"date": pd.to_datetime(self.times[self.filled])}
+        for c in _VALUES:
+            data[c] = self.values[c][self.filled]
+        return pd.DataFrame(data)
+
+    def gaps(self, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None) -> list[Gap]:
+        """Runs of empty slots whose bar-end falls in [start, end] (defaults: first/last filled bar)."""
+        if not self.filled.any():
+            return []
+        filled_idx = np.flatnonzero(self.filled)
+        lo = int(np.searchsorted(self.times, pd.Timestamp(start).to_datetime64())) if start is not None else int(filled_idx[0])
+        hi = int(np.searchsorted(self.times, pd.Timestamp(end).to_datetime64(), side="right")) if end is not None else int(filled_idx[-1]) + 1
+        missing = ~self.filled[lo:hi]
+        if not missing.any():
+            return []
+        edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1) + lo
+        ends = np.flatnonzero(edges == -1) + lo - 1
+        bpd = self.bars_per_day
+        return [
+            Gap(pd.Timestamp(self.times[s]), pd.Timestamp(self.times[e]), int(e - s + 1),
+                bool(s % bpd == 0 and (e + 1) % bpd == 0))
+            for s, e in zip(starts, ends)
+        ]
@@ -0,0 +1,115 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# 本地 K 线仓库：每个 (symbol, 周期) 一个结构化 .npy 文件，可 mmap 只读打开。
+# date 以 int64 纳秒存储（北京时间 naive），其余列为 float64。
+BAR_DTYPE = np.dtype([
+    ("date", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+BAR_COLUMNS = ["date", "open", "high", "low", "close", "volume"]
+
+
+class BarStore:
+    def __init__(self, root: str = os.path.join("data", "bars"), max_bars: Optional[int] = None):
+        self.root = root
+        if max_bars is None:
+            max_bars = int(os.getenv("BAR_STORE_MAX_BARS", "20000"))
+        self.max_bars = max_bars
+
+    def _path(self, symbol: str, tf_min: int) -> str:
+        return os.path.join(self.root, f"{symbol}_{tf_min}m.npy")
+
+    def _read(self, symbol: str, tf_min: int) -> np.ndarray:
+        p = self._path(symbol, tf_min)
+        if not os.path.exists(p):
+            return np.empty(0, dtype=BAR_DTYPE)
+        try:
+            arr = np.load(p, mmap_mode="r")
+            if arr.dtype != BAR_DTYPE:
+                return np.empty(0, dtype=BAR_DTYPE)
+            return arr
+        except Exception as e:
+            print(f"    ⚠️ [BarStore] 读取失败 {p}: {e}", flush=True)
+            return np.empty(0, dtype=BAR_DTYPE)
+
+    def last_timestamp(self, symbol: str, tf_min: int) -> Optional[pd.Timestamp]:
+        arr = self._read(symbol, tf_min)
+        if len(arr) == 0:
+            return None
+        return pd.Timestamp(int(arr["date"][-1]))
+
+    def count(self, symbol: str, tf_min: int) -> int:
+        return len(self._read(symbol, tf_min))
+
+    def load(self, symbol: str, tf_min: int) -> pd.DataFrame:
+        arr = self._read(symbol, tf_min)
+        return _to_frame(arr)
+
+    def merge(self, symbol: str, tf_min: int, df_new: pd.DataFrame) -> pd.DataFrame:
+        """
+        Merges new bars into the store (new rows win on equal timestamps), persists,
+        and returns the full stored frame.
+        """
+        old = self._read(symbol, tf_min)
+        new = _to_records(df_new)
+        if len(new) == 0:
+            return _to_frame(old)
+
+        new = new[np.argsort(new["date"], kind="stable")]
+        # keep='last'：同一时间戳保留最后一条
+        keep_new = np.append(new["date"][1:] != new["date"][:-1], True)
+        new = new[keep_new]
+
+        # 旧数据中早于新数据起点的部分无需排序；重叠段里被新数据覆盖的行丢弃
+        cut = int(np.searchsorted(old["date"], new["date"][0], side="left"))
+        head = old[:cut]
+        tail = old[cut:]
+        if len(tail):
+            tail = tail[~np.isin(tail["date"], new["date"])]
+            new = np.concatenate([tail, new])
+            new = new[np.argsort(new["date"], kind="stable")]
+        merged = np.concatenate([head, new])
+        if self.max_bars and len(merged) > self.max_bars:
+            merged = merged[-self.max_bars:]
+
+        self._write(symbol, tf_min, merged)
+        return _to_frame(merged)
+
+    def _write(self, symbol: str, tf_min: int, arr: np.ndarray) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        p = self._path(symbol, tf_min)
+        tmp = p + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(arr, dtype=BAR_DTYPE))
+            os.replace(tmp, p)
+        except Exception as e:
+            print(f"    ⚠️ [BarStore] 写入失败 {p}: {e}", flush=True)
+
+
+def _to_records(df: pd.DataFrame) -> np.ndarray:
+    if df is None or df.empty:
+        return np.empty(0, dtype=BAR_DTYPE)
+    df = df.dropna(subset=["date", "close"])
+    out = np.empty(len(df), dtype=BAR_DTYPE)
+    out["date"] = pd.to_datetime(df["date"]).to_numpy(dtype="datetime64[ns]").view("i8")
+    for c in BAR_COLUMNS[1:]:
+        out[c] = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype="f8")
+    return out
+
+
+def _to_frame(arr: np.ndarray) -> pd.DataFrame:
+    if len(arr) == 0:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    data = {"date": pd.to_datetime(np.array(arr["date"], dtype="i8").view("datetime64[ns]"))}
+    for c in BAR_COLUMNS[1:]:
+        data[c] = np.array(arr[c], dtype="f8")
+    return pd.DataFrame(data)
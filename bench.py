@@ -0,0 +1,244 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# 闸门路径上绝不应出现的重依赖
+HEAVY_MODULES = (
+    "pandas", "numpy", "akshare", "baostock", "mplfinance", "matplotlib",
+    "openai", "xhtml2pdf", "markdown", "gspread", "requests",
+)
+
+_IMPORT_PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import main
+ms = (time.perf_counter() - t0) * 1000
+print(ms)
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def bench_import(args) -> int:
+    """Cold `import main` in fresh interpreters; fails if it exceeds the budget or pulls in heavy modules."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = _IMPORT_PROBE.format(heavy=HEAVY_MODULES)
+    timings, leaked = [], set()
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=here, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(out.stderr, flush=True)
+            return 1
+        ms, mods = out.stdout.splitlines()[-2:]
+        timings.append(float(ms))
+        leaked.update(m for m in mods.split(",") if m)
+
+    best = min(timings)
+    print(f"import main: best {best:.1f} ms / median {sorted(timings)[len(timings) // 2]:.1f} ms "
+          f"({args.repeat} runs, budget {args.budget_ms:.0f} ms)", flush=True)
+    failed = False
+    if leaked:
+        print(f"❌ 闸门路径导入了重依赖: {', '.join(sorted(leaked))}", flush=True)
+        failed = True
+    if best > args.budget_ms:
+        print(f"❌ import 耗时超出预算: {best:.1f} ms > {args.budget_ms:.0f} ms", flush=True)
+        failed = True
+    return 1 if failed else 0
+
+
+def bench_features(args) -> int:
+    """Wyckoff event detection over the stored CSVs in data/ (per-symbol runtime, ms)."""
+    import glob
+    import time
+
+    import pandas as pd
+    from wyckoff_features import detect_events
+
+    paths = sorted(glob.glob(os.path.join(args.data_dir, "*.csv")))
+    timings, n_events = [], 0
+    for path in paths:
+        df = pd.read_csv(path)
+        if not {"date", "high", "low", "close", "volume"}.issubset(df.columns):
+            continue
+        df["date"] = pd.to_datetime(df["date"])
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            events, _ = detect_events(df)
+            best = min(best, (time.perf_counter() - t0) * 1000)
+        timings.append(best)
+        n_events += len(events)
+    if not timings:
+        print(f"❌ {args.data_dir} 下没有可用的 K 线 CSV", flush=True)
+        return 1
+
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"detect_events: {len(timings)} files, mean {mean:.2f} ms / p95 {p95:.2f} ms / max {timings[-1]:.2f} ms, "
+          f"{n_events} events (budget {args.budget_ms:.0f} ms)", flush=True)
+    if p95 > args.budget_ms:
+        print(f"❌ 事件检测耗时超出预算: p95 {p95:.2f} ms > {args.budget_ms:.0f} ms", flush=True)
+        return 1
+    return 0
+
+
+def _synthetic_frames(n: int, bars: int, seed: int = 0) -> dict:
+    """n random-walk 5m symbols on a shared axis; ~2% of bars dropped to mimic suspensions/gaps."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    axis = pd.date_range("2026-01-05 09:35", periods=bars, freq="5min").to_numpy()
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.003, (n, bars)), axis=1))
+    spread = np.abs(rng.normal(0, 0.004, (n, bars))) * close
+    volume = rng.lognormal(10, 0.6, (n, bars))
+    keep = rng.random((n, bars)) > 0.02
+    frames = {}
+    for i in range(n):
+        m = keep[i]
+        frames[f"{i:06d}"] = pd.DataFrame({
+            "date": axis[m], "open": close[i, m], "high": close[i, m] + spread[i, m],
+            "low": close[i, m] - spread[i, m], "close": close[i, m], "volume": volume[i, m],
+        })
+    return frames
+
+
+def bench_screen(args) -> int:
+    """Panel build + vectorized scoring at several universe sizes on synthetic data."""
+    import time
+
+    from screener import build_panel, score_panel, select
+
+    base = None
+    for n in args.symbols:
+        frames = _synthetic_frames(n, args.bars)
+        t0 = time.perf_counter()
+        panel = build_panel(frames, args.bars)
+        t1 = time.perf_counter()
+        scores = score_panel(panel)
+        picked = select(scores)
+        t2 = time.perf_counter()
+        per_sym = (t2 - t0) * 1e6 / n
+        base = base or per_sym
+        print(f"screen {n:>5} symbols x {args.bars} bars: build {(t1 - t0) * 1000:.0f} ms, score {(t2 - t1) * 1000:.0f} ms, "
+              f"{per_sym:.0f} us/symbol (x{per_sym / base:.2f}), panel {panel.nbytes / 1e6:.1f} MB, picked {len(picked)}", flush=True)
+    return 0
+
+
+def bench_decimate(args) -> int:
+    """Chart preparation at growing bar counts: decimation time, plus render time / PNG size when mplfinance is installed."""
+    import tempfile
+    import time
+
+    import numpy as np
+    import pandas as pd
+
+    os.environ["CHART_CACHE_MAX_MB"] = "0"
+    import charts
+    from decimate import chart_budget, decimate_bars
+
+    try:
+        charts.init_worker()
+        can_render = True
+    except ImportError:
+        can_render = False
+        print("mplfinance 未安装：只测量降采样，跳过渲染", flush=True)
+
+    rng = np.random.default_rng(0)
+    max_candles, keep_recent = chart_budget()
+    out_dir = tempfile.mkdtemp(prefix="bench_decimate_")
+    for n in args.bars:
+        close = 10 * np.exp(np.cumsum(rng.normal(0, 0.003, n)))
+        spread = np.abs(rng.normal(0, 0.004, n)) * close
+        df = pd.DataFrame({
+            "date": pd.date_range("2026-01-05 09:35", periods=n, freq="5min"),
+            "open": np.r_[close[0], close[:-1]], "high": close + spread, "low": close - spread,
+            "close": close, "volume": rng.lognormal(10, 0.6, n),
+        })
+        df["ma50"] = df["close"].rolling(50).mean()
+        df["ma200"] = df["close"].rolling(200).mean()
+
+        t0 = time.perf_counter()
+        small, bucket = decimate_bars(df, max_candles, keep_recent)
+        line = f"{n:>6} bars -> {len(small):>4} candles (bucket {bucket}): decimate {(time.perf_counter() - t0) * 1000:.1f} ms"
+        if can_render:
+            for label, budget in (("decimated", str(max_candles)), ("raw", "0")):
+                if label == "raw" and n > args.raw_limit:
+                    continue
+                os.environ["CHART_MAX_CANDLES"] = budget
+                path = os.path.join(out_dir, f"{n}_{label}.png")
+                t0 = time.perf_counter()
+                charts.render_chart("BENCH", df, path, "5m")
+                line += f", {label} render {time.perf_counter() - t0:.2f}s / {os.path.getsize(path) / 1024:.0f} KB"
+            os.environ["CHART_MAX_CANDLES"] = str(max_candles)
+        print(line, flush=True)
+    return 0
+
+
+def bench_pdf(args) -> int:
+    """Per-stock PDFs vs one digest for N synthetic reports (build time and total size)."""
+    import tempfile
+    import time
+
+    import pdf_report
+
+    try:
+        pdf_report.init_worker()
+    except ImportError as e:
+        print(f"❌ 缺少 PDF 依赖: {e}", flush=True)
+        return 1
+
+    report = "## 威科夫结构分析\n\n" + "\n".join(f"- 第 {i} 段：区间下沿出现放量测试，供应逐步枯竭。" for i in range(40))
+    out_dir = tempfile.mkdtemp(prefix="bench_pdf_")
+    t0 = time.perf_counter()
+    total = 0
+    for i in range(args.stocks):
+        path = os.path.join(out_dir, f"{i:06d}.pdf")
+        pdf_report.build_pdf(f"{i:06d}", [], report, path)
+        total += os.path.getsize(path)
+    single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    path = os.path.join(out_dir, "digest.pdf")
+    pdf_report.build_digest([(f"{i:06d}", [], report) for i in range(args.stocks)], path)
+    digest = time.perf_counter() - t0
+    print(f"{args.stocks} stocks: per-stock PDFs {single / args.stocks * 1000:.0f} ms / {total / args.stocks / 1024:.0f} KB each; "
+          f"digest {digest:.2f}s / {os.path.getsize(path) / 1024:.0f} KB total", flush=True)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Performance benchmarks / regression guards")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("import", help="cold import time of main.py (schedule-gate path)")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--budget-ms", type=float, default=float(os.getenv("BENCH_IMPORT_BUDGET_MS", "300")))
+    p.set_defaults(func=bench_import)
+
+    p = sub.add_parser("features", help="Wyckoff event pre-detector runtime over data/*.csv")
+    p.add_argument("--data-dir", default="data")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--budget-ms", type=float, default=float(os.getenv("BENCH_FEATURES_BUDGET_MS", "20")))
+    p.set_defaults(func=bench_features)
+
+    p = sub.add_parser("screen", help="screening panel build + scoring on synthetic universes")
+    p.add_argument("--symbols", type=int, nargs="+", default=[1000, 5000])
+    p.add_argument("--bars", type=int, default=300)
+    p.set_defaults(func=bench_screen)
+
+    p = sub.add_parser("decimate", help="chart decimation + render time / PNG size vs bar count")
+    p.add_argument("--bars", type=int, nargs="+", default=[500, 2000, 10000])
+    p.add_argument("--raw-limit", type=int, default=2000, help="skip the undecimated render above this many bars")
+    p.set_defaults(func=bench_decimate)
+
+    p = sub.add_parser("pdf", help="per-stock PDF vs digest build time / size")
+    p.add_argument("--stocks", type=int, default=10)
+    p.set_defaults(func=bench_pdf)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import shutil
+import threading
+from typing import Optional
+
+# 图表渲染：进程池 worker 启动时预加载 matplotlib/mplfinance 并建好样式；绘图数据、周期与样式都相同的图直接复用缓存 PNG
+# 修改样式或图表布局时递增，使旧缓存失效
+STYLE_VERSION = "1"
+_DPI = 150
+_MA_LINES = {"ma50": ("#ff9900", 1.5), "ma200": ("#2196f3", 2.0)}
+_HASH_COLUMNS = ("date", "open", "high", "low", "close", "volume", "ma50", "ma200")
+
+_mpf = None
+_style = None
+
+
+def init_worker() -> None:
+    """Process-pool initializer (idempotent): Agg backend, mplfinance import and the market style, once per process."""
+    global _mpf, _style
+    if _mpf is not None:
+        return
+    import matplotlib
+    matplotlib.use("Agg")
+    import mplfinance as mpf
+    mc = mpf.make_marketcolors(up='#ff3333', down='#00b060', edge='inherit', wick='inherit', volume={'up': '#ff3333', 'down': '#00b060'}, inherit=True)
+    _style = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=mc, gridstyle=':', y_on_right=True)
+    _mpf = mpf
+
+
+def chart_key(symbol: str, df, period: str) -> str:
+    """sha256 over the plotted columns, symbol/period (they are in the title), DPI, decimation budget and STYLE_VERSION."""
+    budget = (os.getenv("CHART_MAX_CANDLES", "400"), os.getenv("CHART_RECENT_BARS", "120"))
+    h = hashlib.sha256(f"{STYLE_VERSION}|{_DPI}|{budget}|{symbol}|{period}|{len(df)}".encode("utf-8"))
+    for col in _HASH_COLUMNS:
+        if col in df.columns:
+            arr = df[col].to_numpy()
+            if arr.dtype == object:
+                arr = arr.astype(str)
+            h.update(col.encode("utf-8"))
+            h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+class ChartCache:
+    """PNG files keyed by chart_key under data/chart_cache; oldest evicted past CHART_CACHE_MAX_MB."""
+
+    def __init__(self, root: str = os.path.join("data", "chart_cache"), max_mb: Optional[float] = None):
+        self.root = root
+        if max_mb is None:
+            max_mb = float(os.getenv("CHART_CACHE_MAX_MB", "30"))
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.png")
+
+    def fetch(self, key: str, dest: str) -> bool:
+        if self.max_bytes <= 0:
+            return False
+        p = self._path(key)
+        try:
+            shutil.copyfile(p, dest)
+            os.utime(p)
+            return True
+        except OSError:
+            return False
+
+    def store(self, key: str, src: str) -> None:
+        if self.max_bytes <= 0 or not os.path.exists(src):
+            return
+        p = self._path(key)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, p)
+        except OSError as e:
+            print(f"    ⚠️ 图表缓存写入失败: {e}", flush=True)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        # 多个 worker 进程可能同时淘汰：文件已被删掉时忽略即可
+        try:
+            files = [os.path.join(self.root, n) for n in os.listdir(self.root) if n.endswith(".png")]
+            stats = [(os.path.getmtime(f), os.path.getsize(f), f) for f in files]
+        except OSError:
+            return
+        total = sum(s for _, s, _ in stats)
+        for _, size, f in sorted(stats):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            total -= size
+
+
+_CACHE = ChartCache()
+
+
+def render_chart(symbol: str, df, save_path: str, period: str) -> bool:
+    """Renders one candle chart (volume + MA overlays) to save_path; True if it came from the cache."""
+    if df.empty:
+        return False
+    key = chart_key(symbol, df, period)
+    if _CACHE.fetch(key, save_path):
+        return True
+
+    init_worker()
+    from decimate import chart_budget, decimate_bars
+    # 超出像素预算的较早 K 线按桶合并，渲染耗时与 PNG 大小不随 bars 增长
+    max_candles, keep_recent = chart_budget()
+    plot_df, bucket = decimate_bars(df, max_candles, keep_recent)
+    note = f", older bars as {bucket}-bar candles, last {keep_recent} full" if bucket > 1 else ""
+    plot_df = plot_df.set_index("date") if "date" in plot_df.columns else plot_df
+    apds = [_mpf.make_addplot(plot_df[col], color=color, width=width)
+            for col, (color, width) in _MA_LINES.items() if col in plot_df.columns]
+    try:
+        _mpf.plot(plot_df, type='candle', style=_style, addplot=apds, volume=True,
+                  title=f"Wyckoff: {symbol} ({period} | {len(df)} bars{note})",
+                  savefig=dict(fname=save_path, dpi=_DPI, bbox_inches='tight'),
+                  warn_too_much_data=2000)
+    except Exception as e:
+        print(f"    [Error] 绘图失败: {e}", flush=True)
+        return False
+    _CACHE.store(key, save_path)
+    return False
+
+
+def render_charts(symbol: str, frames: dict, chart_paths: list[str]) -> int:
+    """One chart per timeframe (multi-timeframe rows) as a single render job; returns the number of cache hits."""
+    hits = sum(render_chart(symbol, df, path, period) for (period, df), path in zip(frames.items(), chart_paths))
+    if hits:
+        print(f"    🖼️ [{symbol}] 图表缓存命中 {hits}/{len(chart_paths)}，跳过渲染", flush=True)
+    return hits
@@ -0,0 +1,120 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    """The provider's breaker is open: skip it without a network call."""
+    pass
+
+
+def next_pacific_midnight(now: Optional[datetime] = None) -> float:
+    """Epoch seconds of the next 00:00 America/Los_Angeles (Gemini daily quota reset)."""
+    try:
+        from zoneinfo import ZoneInfo
+        tz = ZoneInfo("America/Los_Angeles")
+    except Exception:
+        tz = timezone(timedelta(hours=-8))
+    now = (now or datetime.now(timezone.utc)).astimezone(tz)
+    nxt = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return nxt.timestamp()
+
+
+class CircuitBreaker:
+    """
+    closed -> open on a quota/fatal error, until `open_until`; then half-open, where exactly one
+    caller is let through as a probe. Probe success closes the breaker, a quota/fatal failure
+    re-opens it, any other failure frees the probe slot for the next caller.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.reason = ""
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.time() < self.open_until:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            print(f"    🔌 [{self.name}] 熔断半开，放行一次探测请求", flush=True)
+            return True
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"    🔌 [{self.name}] 探测成功，熔断关闭", flush=True)
+            self.state, self.reason, self._probing = CLOSED, "", False
+
+    def on_failure(self, reason: Optional[str], open_until: Optional[float] = None) -> None:
+        """reason=None means a transient error that must not trip the breaker."""
+        with self._lock:
+            if reason is None or open_until is None:
+                self._probing = False
+                return
+            self.state, self.open_until, self.reason, self._probing = OPEN, open_until, reason, False
+        until = datetime.fromtimestamp(open_until, timezone(timedelta(hours=8))).strftime("%m-%d %H:%M")
+        print(f"    🔌 [{self.name}] 熔断打开 ({reason})，北京时间 {until} 前跳过该模型", flush=True)
+
+    def describe(self) -> str:
+        until = datetime.fromtimestamp(self.open_until, timezone(timedelta(hours=8))).strftime("%m-%d %H:%M")
+        return f"{self.name} 熔断中 ({self.reason}，至北京时间 {until})"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            # 半开状态不跨运行保留：下次运行重新探测
+            state = OPEN if self.state == HALF_OPEN else self.state
+            return {"state": state, "open_until": self.open_until, "reason": self.reason}
+
+    def restore(self, entry: dict) -> None:
+        if (entry or {}).get("state") != OPEN:
+            return
+        try:
+            self.open_until = float(entry.get("open_until", 0))
+        except (TypeError, ValueError):
+            return
+        self.state, self.reason = OPEN, str(entry.get("reason", ""))
+
+
+class BreakerRegistry:
+    """One breaker per provider, shared by every stock; state round-trips through run_state.json."""
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._saved: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name)
+                self._breakers[name].restore(self._saved.get(name) or {})
+            return self._breakers[name]
+
+    def load_state(self, saved: dict) -> None:
+        with self._lock:
+            self._saved = dict(saved or {})
+            for name, b in self._breakers.items():
+                b.restore(self._saved.get(name) or {})
+
+    def snapshot(self) -> dict:
+        out = dict(self._saved)
+        for name, b in self._breakers.items():
+            out[name] = b.snapshot()
+        return out
+
+
+BREAKERS = BreakerRegistry()
@@ -0,0 +1,82 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# 绘图前的降采样：较早的 K 线按桶合并为一根（OHLC 语义，极值不丢），均线用 LTTB 在每个桶里选点；最近的 K 线保持原始分辨率
+
+_MA_COLUMNS = ("ma50", "ma200")
+
+
+def chart_budget() -> tuple[int, int]:
+    """(max candles per chart, most recent bars kept at full resolution)."""
+    return int(os.getenv("CHART_MAX_CANDLES", "400")), int(os.getenv("CHART_RECENT_BARS", "120"))
+
+
+def lttb_pick(x: np.ndarray, y: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets with caller-given buckets [bounds[i], bounds[i+1]): one index
+    per bucket, the point forming the largest triangle with the previously picked point and the
+    next bucket's mean. First/last buckets keep their first/last point; NaN points are never picked
+    unless the whole bucket is NaN.
+    """
+    nb = len(bounds) - 1
+    picked = np.empty(nb, dtype=np.int64)
+    picked[0] = bounds[0]
+    for i in range(1, nb):
+        lo, hi = bounds[i], bounds[i + 1]
+        if i == nb - 1:
+            picked[i] = hi - 1
+            break
+        nxt_y = y[bounds[i + 1]:bounds[i + 2]]
+        nxt_y = nxt_y[np.isfinite(nxt_y)]
+        ax, ay = x[picked[i - 1]], y[picked[i - 1]]
+        cx = x[bounds[i + 1]:bounds[i + 2]].mean()
+        cy = nxt_y.mean() if len(nxt_y) else ay
+        seg_y = y[lo:hi]
+        area = np.abs((ax - cx) * (seg_y - ay) - (ax - x[lo:hi]) * (cy - ay))
+        area[~np.isfinite(area)] = -1.0
+        picked[i] = lo + int(np.argmax(area))
+    return picked
+
+
+def decimate_bars(df: pd.DataFrame, max_candles: int = None, keep_recent: int = None) -> tuple[pd.DataFrame, int]:
+    """
+    Reduces df to about max_candles rows: the last keep_recent rows untouched, older rows merged
+    into equal buckets (first open, max high, min low, last close, summed volume, last date),
+    MA columns sampled per bucket with LTTB; only the plotted columns are kept.
+    Returns (frame, bucket size); bucket size 1 = df unchanged.
+    """
+    if max_candles is None or keep_recent is None:
+        default_max, default_recent = chart_budget()
+        max_candles = default_max if max_candles is None else max_candles
+        keep_recent = default_recent if keep_recent is None else keep_recent
+    n = len(df)
+    keep_recent = max(0, min(keep_recent, max_candles - 1))
+    if max_candles <= 0 or n <= max_candles:
+        return df, 1
+
+    old_n = n - keep_recent
+    size = math.ceil(old_n / (max_candles - keep_recent))
+    # 桶边界从最新一端对齐：最早的桶可能不满
+    starts = np.arange(old_n, 0, -size)[::-1] - size
+    starts = np.maximum(starts, 0)
+    bounds = np.r_[starts, old_n]
+
+    old = df.iloc[:old_n]
+    out = {
+        "date": old["date"].to_numpy()[bounds[1:] - 1],
+        "open": old["open"].to_numpy()[bounds[:-1]],
+        "high": np.fmax.reduceat(old["high"].to_numpy(dtype=np.float64), bounds[:-1]),
+        "low": np.fmin.reduceat(old["low"].to_numpy(dtype=np.float64), bounds[:-1]),
+        "close": old["close"].to_numpy()[bounds[1:] - 1],
+        "volume": np.add.reduceat(np.nan_to_num(old["volume"].to_numpy(dtype=np.float64)), bounds[:-1]),
+    }
+    x = np.arange(old_n, dtype=np.float64)
+    for col in _MA_COLUMNS:
+        if col in df.columns:
+            y = old[col].to_numpy(dtype=np.float64)
+            out[col] = y[lttb_pick(x, y, bounds)]
+    head = pd.DataFrame(out)
+    return pd.concat([head, df.iloc[old_n:][list(head.columns)]], ignore_index=True), size
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+# 只有真正出现过这些断连的 host 才退回“每请求一条连接”
+_DISCONNECT_MARKERS = ("RemoteDisconnected", "Connection aborted", "Connection reset by peer")
+# 被标记的 host 在该时长后重新尝试 keep-alive
+_CLOSE_HOST_TTL_S = 24 * 3600
+
+
+def is_disconnect_error(exc: BaseException) -> bool:
+    """True if exc (or anything in its cause/context chain) is a server-side connection drop."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, (ConnectionResetError, ConnectionAbortedError)):
+            return True
+        text = f"{type(exc).__name__}: {exc}"
+        if any(m in text for m in _DISCONNECT_MARKERS):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+class ClientRegistry:
+    """
+    One pooled requests.Session / OpenAI client per provider per process, reused across stocks.
+    Keep-alive is on (HTTP_KEEPALIVE) except for hosts that have actually dropped a connection,
+    which get `Connection: close`; those hosts round-trip through run_state.json.
+    """
+
+    def __init__(self):
+        self.keepalive = (os.getenv("HTTP_KEEPALIVE") or "1").strip().lower() in ("1", "true", "yes", "y", "on")
+        self.pool_size = max(1, int(os.getenv("HTTP_POOL_SIZE", "4")))
+        self._sessions: dict = {}
+        self._openai: dict = {}
+        self._close_hosts: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    # ---- keep-alive policy ----
+
+    def use_keepalive(self, host: str) -> bool:
+        if not self.keepalive:
+            return False
+        with self._lock:
+            marked = self._close_hosts.get(host)
+            if marked is not None and time.time() - marked > _CLOSE_HOST_TTL_S:
+                del self._close_hosts[host]
+                marked = None
+        return marked is None
+
+    def connection_headers(self, url: str) -> dict:
+        return {} if self.use_keepalive(host_of(url)) else {"Connection": "close"}
+
+    def report_error(self, url: str, exc: BaseException) -> None:
+        """Marks the host for connection-per-request if exc is a real connection drop."""
+        if not self.keepalive or not is_disconnect_error(exc):
+            return
+        host = host_of(url)
+        with self._lock:
+            first = host not in self._close_hosts
+            self._close_hosts[host] = time.time()
+            # 已缓存的 OpenAI 客户端按新策略重建
+            self._openai = {k: v for k, v in self._openai.items() if k[2] != host}
+        if first:
+            print(f"    🔌 {host} 出现断连，之后对该 host 改为每请求新建连接", flush=True)
+
+    # ---- clients ----
+
+    def session(self, name: str):
+        """Pooled requests.Session for one provider."""
+        with self._lock:
+            s = self._sessions.get(name)
+            if s is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                self._sessions[name] = s
+            return s
+
+    def request(self, name: str, method: str, url: str, **kwargs):
+        """session(name).request(...) with the host's keep-alive policy; connection drops mark the host."""
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update(self.connection_headers(url))
+        try:
+            return self.session(name).request(method, url, headers=headers, **kwargs)
+        except Exception as e:
+            self.report_error(url, e)
+            raise
+
+    def openai(self, name: str, api_key: str, base_url: Optional[str] = None):
+        """Cached OpenAI client per (provider, key, host); rebuilt with `Connection: close` for marked hosts."""
+        host = host_of(base_url or "https://api.openai.com/v1")
+        key = (name, api_key, host)
+        with self._lock:
+            client = self._openai.get(key)
+        if client is not None:
+            return client
+        from openai import OpenAI
+        kwargs = {"api_key": api_key}
+        if base_url:
+            kwargs["base_url"] = base_url
+        if not self.use_keepalive(host):
+            kwargs["default_headers"] = {"Connection": "close"}
+        client = OpenAI(**kwargs)
+        with self._lock:
+            return self._openai.setdefault(key, client)
+
+    # ---- run_state ----
+
+    def load_state(self, saved: dict) -> None:
+        with self._lock:
+            for host, ts in (saved or {}).items():
+                try:
+                    self._close_hosts[host] = float(ts)
+                except (TypeError, ValueError):
+                    pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._close_hosts)
+
+
+CLIENTS = ClientRegistry()
@@ -0,0 +1,115 @@
+import bisect
+import threading
+import time
+from typing import Optional
+
+# 直方图桶上界（秒），近似对数分布；最后一个桶收容所有更慢的请求
+BUCKETS = (0.5, 1, 2, 3, 5, 8, 12, 18, 25, 35, 50, 70, 100, 140, 200, 300)
+# 样本总数超过该值时全部计数减半，让旧样本逐步淡出
+_HALVE_AT = 400
+
+
+class LatencyHistogram:
+    """
+    Bucketed latency distribution for one provider plus a failure count. Successful calls are
+    exact samples; abandoned calls (losing hedges) are censored samples: only known to take at
+    least their elapsed time.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.censored = [0] * (len(BUCKETS) + 1)
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool = True, censored: bool = False) -> None:
+        with self._lock:
+            if not ok:
+                self.failures += 1
+                return
+            (self.censored if censored else self.counts)[bisect.bisect_left(BUCKETS, seconds)] += 1
+            if sum(self.counts) + sum(self.censored) > _HALVE_AT:
+                self.counts = [c // 2 for c in self.counts]
+                self.censored = [c // 2 for c in self.censored]
+                self.failures //= 2
+
+    @property
+    def samples(self) -> int:
+        return sum(self.counts) + sum(self.censored)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Upper bound (seconds) of the bucket holding the q-quantile; None without samples.
+        Censored samples are redistributed to the right (Efron): each one's weight is spread over
+        the slower buckets in proportion to their mass, or stays at its own bucket when none is slower.
+        """
+        with self._lock:
+            mass = [float(c) for c in self.counts]
+            for i, c in enumerate(self.censored):
+                if not c:
+                    continue
+                above = sum(mass[i + 1:])
+                if above > 0:
+                    for j in range(i + 1, len(mass)):
+                        mass[j] += c * mass[j] / above
+                else:
+                    mass[i] += c
+        total = sum(mass)
+        if total == 0:
+            return None
+        target = q * total
+        seen = 0.0
+        for i, m in enumerate(mass):
+            seen += m
+            if seen >= target:
+                return float(BUCKETS[min(i, len(BUCKETS) - 1)])
+        return float(BUCKETS[-1])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"buckets": list(BUCKETS), "counts": list(self.counts), "censored": list(self.censored),
+                    "failures": self.failures, "updated": int(time.time())}
+
+    def restore(self, entry: dict) -> None:
+        # 桶定义变化时丢弃旧直方图
+        if list(entry.get("buckets") or []) != list(BUCKETS):
+            return
+        counts = entry.get("counts") or []
+        censored = entry.get("censored") or [0] * len(self.censored)
+        if len(counts) == len(self.counts) and len(censored) == len(self.censored):
+            with self._lock:
+                self.counts = [int(c) for c in counts]
+                self.censored = [int(c) for c in censored]
+                self.failures = int(entry.get("failures", 0))
+
+
+class LatencyRegistry:
+    """Per-provider histograms; round-trip through run_state.json like the rate controllers."""
+
+    def __init__(self):
+        self._hists: dict[str, LatencyHistogram] = {}
+        self._saved: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> LatencyHistogram:
+        with self._lock:
+            if name not in self._hists:
+                self._hists[name] = LatencyHistogram(name)
+                self._hists[name].restore(self._saved.get(name) or {})
+            return self._hists[name]
+
+    def load_state(self, saved: dict) -> None:
+        with self._lock:
+            self._saved = dict(saved or {})
+            for name, h in self._hists.items():
+                h.restore(self._saved.get(name) or {})
+
+    def snapshot(self) -> dict:
+        out = dict(self._saved)
+        for name, h in self._hists.items():
+            out[name] = h.snapshot()
+        return out
+
+
+LLM_LATENCY = LatencyRegistry()
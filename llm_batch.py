@@ -0,0 +1,53 @@
+import re
+
+# 批量分析：多只股票共用一次请求里的模板说明，模型按分隔行输出各自的报告，再拆回每只股票
+_BEGIN = "<<<REPORT {symbol}>>>"
+_END = "<<<END {symbol}>>>"
+
+
+def pack(sizes: list[tuple], budget: int, max_symbols: int) -> list[list]:
+    """Greedy in-order packing of (key, tokens) into batches of <= budget tokens and <= max_symbols keys."""
+    batches, cur, used = [], [], 0
+    for key, tokens in sizes:
+        if cur and (used + tokens > budget or len(cur) >= max_symbols):
+            batches.append(cur)
+            cur, used = [], 0
+        cur.append(key)
+        used += tokens
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def build_prompt(template: str, sections: list[tuple[str, str]]) -> str:
+    """
+    The template once (per-symbol placeholders pointing at the sections), then one delimited
+    data section per symbol and the output format the reports are split on.
+    """
+    symbols = [s for s, _ in sections]
+    preamble = (template
+        .replace("{symbol}", "each symbol listed below")
+        .replace("{latest_time}", "the latest bar time given in that symbol's section")
+        .replace("{latest_price}", "the latest price given in that symbol's section")
+        .replace("{csv_data}", "(bar data for each symbol follows in the sections below)")
+    )
+    body = "\n\n".join(f"=== SYMBOL {s} ===\n{text}\n=== END SYMBOL {s} ===" for s, text in sections)
+    fmt = "\n".join(f"{_BEGIN.format(symbol=s)}\n...\n{_END.format(symbol=s)}" for s in symbols)
+    return (
+        f"{preamble}\n\n[BATCH] Analyze each of the {len(symbols)} symbols below independently "
+        f"({', '.join(symbols)}). Do not compare or merge them.\n\n{body}\n\n"
+        f"[OUTPUT FORMAT] Write one complete report per symbol, exactly as you would for a single symbol, "
+        f"each wrapped in its own marker lines, in this order:\n{fmt}"
+    )
+
+
+def split_reports(text: str, symbols: list[str], min_chars: int = 200) -> dict[str, str]:
+    """Per-symbol reports from a batched response; symbols whose section is missing, unterminated or too short are left out."""
+    out = {}
+    for s in symbols:
+        begin, end = re.escape(_BEGIN.format(symbol=s)), re.escape(_END.format(symbol=s))
+        # 必须有结束行：被截断的最后一段不算解析成功
+        m = re.search(rf"{begin}\s*(.*?)\s*{end}", text or "", re.S)
+        if m and len(m.group(1).strip()) >= min_chars:
+            out[s] = m.group(1).strip()
+    return out
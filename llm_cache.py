@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+class LLMCache:
+    """
+    Persistent LLM response cache: one JSON file per sha256(provider, model, prompt) under
+    data/llm_cache. Entries expire after ttl_hours; once the directory grows past max_mb the
+    oldest entries are evicted. Only successful provider responses are stored.
+    """
+
+    def __init__(self, root: str = os.path.join("data", "llm_cache"),
+                 ttl_hours: Optional[float] = None, max_mb: Optional[float] = None):
+        self.root = root
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv("LLM_CACHE_TTL_HOURS", "72"))
+        if max_mb is None:
+            max_mb = float(os.getenv("LLM_CACHE_MAX_MB", "50"))
+        self.ttl_s = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt: str, provider: str, model: str) -> str:
+        h = hashlib.sha256()
+        for part in (provider, model, prompt):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, prompt: str, provider: str, model: str) -> Optional[str]:
+        p = self._path(self.key(prompt, provider, model))
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - float(entry.get("created", 0)) > self.ttl_s:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            return None
+        return entry.get("text")
+
+    def lookup(self, prompt: str, chain: list[tuple[str, str]]) -> Optional[tuple[str, str]]:
+        """First cached (provider, text) along the fallback chain; counts one hit or miss."""
+        for provider, model in chain:
+            text = self.get(prompt, provider, model)
+            if text:
+                with self._lock:
+                    self.hits += 1
+                return provider, text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, prompt: str, provider: str, model: str, text: str) -> None:
+        if not text:
+            return
+        entry = {"provider": provider, "model": model, "created": time.time(), "text": text}
+        p = self._path(self.key(prompt, provider, model))
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = f"{p}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, p)
+        except OSError as e:
+            print(f"    ⚠️ LLM 缓存写入失败: {e}", flush=True)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            try:
+                files = [os.path.join(self.root, n) for n in os.listdir(self.root) if n.endswith(".json")]
+                stats = [(os.path.getmtime(f), os.path.getsize(f), f) for f in files]
+            except OSError:
+                return
+            now = time.time()
+            total = sum(s for _, s, _ in stats)
+            for mtime, size, f in sorted(stats):
+                if total <= self.max_bytes and now - mtime <= self.ttl_s:
+                    break
+                try:
+                    os.remove(f)
+                    total -= size
+                except OSError:
+                    pass
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"LLM 缓存: 命中 {self.hits} / 未命中 {self.misses} ({rate:.0f}%)"
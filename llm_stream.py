@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+# 流式读取：首 token 超时 (TTFT) 与 token 间停顿超时分开计时，输出中途卡死的服务在停顿超时后即可放弃，已收到的部分保留
+_DONE = object()
+_CANCELLED = object()
+# 等待下一块时检查取消信号的间隔（秒）
+_CANCEL_POLL = 0.5
+# EWMA 平滑系数
+_ALPHA = 0.2
+
+
+class StreamStalled(Exception):
+    """No first token within the TTFT timeout, or no new chunk within the stall timeout. `partial` holds what arrived."""
+
+    def __init__(self, phase: str, waited: float, partial: str = ""):
+        super().__init__(f"stream {phase} timeout after {waited:.1f}s ({len(partial)} chars received)")
+        self.phase = phase
+        self.partial = partial
+
+
+class StreamCancelled(Exception):
+    """The caller abandoned the stream (a losing hedge); the connection has been closed."""
+
+
+class StreamResult(NamedTuple):
+    text: str
+    ttft: float      # 秒；未收到任何内容时为 None
+    duration: float
+
+
+def stream_timeouts() -> tuple[float, float]:
+    """
+    (TTFT, stall) seconds. TTFT defaults to GEMINI_TIMEOUT: thinking models emit no text while they
+    think (thought parts are skipped), so a healthy answer can take as long as a non-streamed call did.
+    """
+    ttft = os.getenv("LLM_TTFT_TIMEOUT") or os.getenv("GEMINI_TIMEOUT") or "120"
+    return float(ttft), float(os.getenv("LLM_STALL_TIMEOUT", "20"))
+
+
+def _close_quietly(close: Optional[Callable[[], None]]) -> None:
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def _next_item(q: queue.Queue, limit: float, cancel: Optional[threading.Event]):
+    if cancel is None:
+        return q.get(timeout=limit)
+    end = time.monotonic() + limit
+    while not cancel.is_set():
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            raise queue.Empty
+        try:
+            return q.get(timeout=min(remaining, _CANCEL_POLL))
+        except queue.Empty:
+            continue
+    return _CANCELLED
+
+
+def consume(chunks: Iterable[str], ttft_s: float, stall_s: float, close: Optional[Callable[[], None]] = None,
+            cancel: Optional[threading.Event] = None) -> StreamResult:
+    """
+    Drains a text-chunk iterator on a daemon reader thread with separate first-token / inter-chunk
+    timeouts. On timeout `close` is called (to release the connection) and StreamStalled carries
+    the partial text; an error raised by the iterator gets the partial text as `.partial` too.
+    Setting `cancel` closes the stream within _CANCEL_POLL seconds and raises StreamCancelled.
+    """
+    q: queue.Queue = queue.Queue()
+
+    def reader():
+        try:
+            for chunk in chunks:
+                if chunk:
+                    q.put(chunk)
+            q.put(_DONE)
+        except BaseException as e:
+            q.put(e)
+
+    threading.Thread(target=reader, name="llm-stream", daemon=True).start()
+    t0 = time.monotonic()
+    parts: list[str] = []
+    ttft = None
+    while True:
+        phase, limit = ("stall", stall_s) if parts else ("ttft", ttft_s)
+        try:
+            item = _next_item(q, limit, cancel)
+        except queue.Empty:
+            _close_quietly(close)
+            raise StreamStalled(phase, limit, "".join(parts))
+        if item is _CANCELLED:
+            _close_quietly(close)
+            raise StreamCancelled(f"stream abandoned after {time.monotonic() - t0:.1f}s")
+        if item is _DONE:
+            return StreamResult("".join(parts), ttft, time.monotonic() - t0)
+        if isinstance(item, BaseException):
+            item.partial = "".join(parts)
+            raise item
+        if ttft is None:
+            ttft = time.monotonic() - t0
+        parts.append(item)
+
+
+class StreamStats:
+    """Per-provider EWMA of time-to-first-token and output tokens/sec, plus stall counts; round-trips through run_state.json."""
+
+    def __init__(self):
+        self._stats: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, result: StreamResult, tokens: int) -> None:
+        with self._lock:
+            s = self._stats.setdefault(provider, {"ttft": None, "tps": None, "samples": 0, "stalls": 0})
+            gen = result.duration - (result.ttft or 0.0)
+            for key, value in (("ttft", result.ttft), ("tps", tokens / gen if gen > 0 else None)):
+                if value is not None:
+                    s[key] = value if s[key] is None else (1 - _ALPHA) * s[key] + _ALPHA * value
+            s["samples"] += 1
+
+    def record_stall(self, provider: str) -> None:
+        with self._lock:
+            s = self._stats.setdefault(provider, {"ttft": None, "tps": None, "samples": 0, "stalls": 0})
+            s["stalls"] += 1
+
+    def summary(self) -> str:
+        with self._lock:
+            items = [(p, s) for p, s in self._stats.items() if s["samples"] or s["stalls"]]
+        return ", ".join(
+            f"{p} TTFT≈{s['ttft'] or 0:.1f}s {s['tps'] or 0:.0f} tok/s (中断 {s['stalls']})" for p, s in items
+        ) or "无"
+
+    def load_state(self, saved: dict) -> None:
+        with self._lock:
+            for provider, s in (saved or {}).items():
+                if isinstance(s, dict):
+                    self._stats[provider] = {"ttft": s.get("ttft"), "tps": s.get("tps"),
+                                             "samples": int(s.get("samples", 0)), "stalls": int(s.get("stalls", 0))}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {p: dict(s) for p, s in self._stats.items()}
+
+
+STREAM_STATS = StreamStats()
@@ -1,22 +1,71 @@
+from __future__ import annotations
+
 import os
+import sys
 import time
-import requests
 from datetime import datetime, timedelta, timezone
-import pandas as pd
-import akshare as ak
-import baostock as bs
-import mplfinance as mpf
-from openai import OpenAI
-import numpy as np
-import markdown
-from xhtml2pdf import pisa
-from sheet_manager import SheetManager
+from rate_control import RATE_LIMITS, is_throttle_error
+from trade_calendar import SESSION_MINUTES, get_trade_calendar, next_trading_day_or_weekday, prev_trading_day_or_weekday
+from llm_cache import LLMCache
+from materiality import AnalysisState
+from latency import LLM_LATENCY
+from circuit_breaker import BREAKERS, CircuitOpen, next_pacific_midnight
+from http_clients import CLIENTS
+from llm_stream import STREAM_STATS, StreamCancelled, StreamStalled, consume, stream_timeouts
+import charts
+import pdf_report
+from prompt_encoding import encode_pyramid, estimate_tokens, prompt_encoding
+import llm_batch
 
 import json
 import random
 import re
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from typing import Optional
 
+# ==========================================
+# 重依赖延迟加载：闸门 / 交易日历缓存 / run_state 只用标准库，
+# 确认命中时间窗后才导入 pandas / akshare 等（每 5 分钟的空跑不再为此付出数秒）；绘图 / PDF 依赖只在各自的 worker 进程中导入
+# ==========================================
+
+pd = np = ak = requests = None
+SheetManager = BarStore = BarGrid = BaoStockSession = VolumeUnitCalibrator = None
+parse_timeframes = resample_bars = detect_events = format_events = None
+build_panel = score_panel = select_symbols = None
+
+def _load_heavy_modules() -> None:
+    """Imports the heavy dependencies and builds the data-layer singletons (idempotent)."""
+    global pd, np, ak, requests, SheetManager
+    global BarStore, BarGrid, BaoStockSession, VolumeUnitCalibrator, parse_timeframes, resample_bars
+    global detect_events, format_events, build_panel, score_panel, select_symbols
+    global _VOLUME_UNITS, _BS_SESSION, _BAR_STORE
+    if pd is not None:
+        return
+    import requests as _requests
+    import pandas as _pd
+    import numpy as _np
+    import akshare as _ak
+    from sheet_manager import SheetManager as _SheetManager
+    from bar_store import BarStore as _BarStore
+    from bar_grid import BarGrid as _BarGrid
+    from baostock_session import BaoStockSession as _BaoStockSession
+    from resample import parse_timeframes as _parse_timeframes, resample_bars as _resample_bars
+    from volume_units import VolumeUnitCalibrator as _VolumeUnitCalibrator
+    from wyckoff_features import detect_events as _detect_events, format_events as _format_events
+    from screener import build_panel as _build_panel, score_panel as _score_panel, select as _select
+
+    requests, pd, np, ak = _requests, _pd, _np, _ak
+    SheetManager, BarStore, BarGrid, BaoStockSession = _SheetManager, _BarStore, _BarGrid, _BaoStockSession
+    parse_timeframes, resample_bars, VolumeUnitCalibrator = _parse_timeframes, _resample_bars, _VolumeUnitCalibrator
+    detect_events, format_events = _detect_events, _format_events
+    build_panel, score_panel, select_symbols = _build_panel, _score_panel, _select
+
+    _VOLUME_UNITS = VolumeUnitCalibrator()
+    _BS_SESSION = BaoStockSession(rate=_BS_RATE)
+    _BAR_STORE = BarStore()
+
 # ==========================================
 # Beijing timezone + A-share schedule helpers
 # ==========================================
@@ -51,88 +100,6 @@ def _parse_hhmm_list(value: str) -> list[str]:
 def _hhmm_to_time(hhmm: str) -> tuple[int, int]:
     return int(hhmm[:2]), int(hhmm[2:])
 
-def _trade_calendar_cache_path() -> str:
-    os.makedirs("data", exist_ok=True)
-    return os.path.join("data", "trade_calendar_sina.csv")
-
-def _load_trade_calendar() -> set[str]:
-    """
-    Returns trading days as 'YYYY-MM-DD' strings.
-    Tries cached file first; otherwise queries AkShare and writes cache.
-    """
-    cache_path = _trade_calendar_cache_path()
-    # Cache TTL: 7 days
-    try:
-        if os.path.exists(cache_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(cache_path), _BJ_TZ)
-            if (_bj_now() - mtime) < timedelta(days=7):
-                df = pd.read_csv(cache_path)
-                col = "date" if "date" in df.columns else (df.columns[0] if len(df.columns) else None)
-                if col:
-                    return set(str(x)[:10] for x in df[col].dropna().astype(str).tolist())
-    except Exception:
-        pass
-
-    try:
-        cal = ak.tool_trade_date_hist_sina()
-        for c in ("trade_date", "日期", "date"):
-            if c in cal.columns:
-                col = c
-                break
-        else:
-            col = cal.columns[0]
-
-        dates: list[str] = []
-        for v in cal[col].dropna().astype(str).tolist():
-            v = v.strip()
-            if re.fullmatch(r"\d{8}", v):
-                dates.append(f"{v[0:4]}-{v[4:6]}-{v[6:8]}")
-            else:
-                dates.append(v[:10])
-
-        out = sorted(set(dates))
-        try:
-            pd.DataFrame({"date": out}).to_csv(cache_path, index=False)
-        except Exception:
-            pass
-        return set(out)
-    except Exception as e:
-        # Worst-case fallback: weekday heuristic (may run on holidays)
-        print(f"    ⚠️ 交易日历获取失败，退化为工作日判断: {e}", flush=True)
-        return set()
-
-def _is_trade_day(d: datetime.date, trade_days: set[str]) -> bool:
-    s = d.strftime("%Y-%m-%d")
-    if trade_days:
-        return s in trade_days
-    return d.weekday() < 5
-
-def _last_completed_bar_end(now_bj: datetime, tf_min: int, trade_days: set[str]) -> datetime:
-    """
-    Approximate last completed bar end time (Beijing). For our push times (11:40, 15:20) this is enough.
-    """
-    if not _is_trade_day(now_bj.date(), trade_days):
-        return now_bj.replace(hour=15, minute=0, second=0, microsecond=0)
-
-    m_open = now_bj.replace(hour=9, minute=30, second=0, microsecond=0)
-    m_close = now_bj.replace(hour=11, minute=30, second=0, microsecond=0)
-    a_open = now_bj.replace(hour=13, minute=0, second=0, microsecond=0)
-    a_close = now_bj.replace(hour=15, minute=0, second=0, microsecond=0)
-
-    if now_bj < m_open:
-        return a_close
-    if m_open <= now_bj <= m_close:
-        minutes = int((now_bj - m_open).total_seconds() // 60)
-        end_min = (minutes // tf_min) * tf_min
-        return m_open + timedelta(minutes=end_min)
-    if m_close < now_bj < a_open:
-        return m_close
-    if a_open <= now_bj <= a_close:
-        minutes = int((now_bj - a_open).total_seconds() // 60)
-        end_min = (minutes // tf_min) * tf_min
-        return a_open + timedelta(minutes=end_min)
-    return a_close
-
 def _trim_future_rows(df: pd.DataFrame, now_bj: datetime) -> pd.DataFrame:
     if df.empty or "date" not in df.columns:
         return df
@@ -141,21 +108,26 @@ def _trim_future_rows(df: pd.DataFrame, now_bj: datetime) -> pd.DataFrame:
     cutoff = now_bj.replace(tzinfo=None)
     return out[out["date"] <= cutoff]
 
-def _refresh_akshare_recent(symbol_code: str, tf_min: int, start_days_back: int = 7) -> pd.DataFrame:
-    start = (_bj_now() - timedelta(days=start_days_back)).strftime("%Y%m%d")
+def _refresh_akshare_recent(symbol_code: str, tf_min: int, start_dt: datetime, end_dt: Optional[datetime] = None) -> pd.DataFrame:
+    """Re-pulls AkShare bars whose bar-end lies in [start_dt, end_dt] (open-ended if end_dt is None)."""
+    start = start_dt.strftime("%Y-%m-%d %H:%M:%S")
+    end = end_dt.strftime("%Y-%m-%d %H:%M:%S") if end_dt is not None else "2222-01-01 09:32:00"
     df_ak = pd.DataFrame()
     max_ak_retries = 3
     for ak_attempt in range(1, max_ak_retries + 1):
         try:
-            time.sleep(random.uniform(1.0, 3.0))
-            df_temp = ak.stock_zh_a_hist_min_em(symbol=symbol_code, period=str(tf_min), start_date=start, adjust="qfq")
+            _AK_RATE.acquire()
+            with _SOURCE_LIMITS["akshare"]:
+                df_temp = ak.stock_zh_a_hist_min_em(symbol=symbol_code, period=str(tf_min), start_date=start, end_date=end, adjust="qfq")
+            _AK_RATE.on_success()
             if not df_temp.empty:
                 df_ak = df_temp
                 break
         except Exception as e:
-            wait_s = ak_attempt * 5 + random.random()
-            print(f"    ⚠️ AkShare 补拉失败 ({ak_attempt}/{max_ak_retries}): {str(e)[:120]} 等待 {wait_s:.1f}s", flush=True)
-            time.sleep(wait_s)
+            # 限流则乘性降速；下一次 acquire 自然按新速率等待
+            if is_throttle_error(e):
+                _AK_RATE.on_throttle()
+            print(f"    ⚠️ AkShare 补拉失败 ({ak_attempt}/{max_ak_retries}): {str(e)[:120]}", flush=True)
 
     if df_ak.empty:
         return df_ak
@@ -180,43 +152,141 @@ def _ensure_latest_data(symbol_code: str, tf_min: int, limit: int, df_final: pd.
     if df_final.empty:
         return df_final
 
-    trade_days = _load_trade_calendar()
+    cal = get_trade_calendar()
     now_bj = _bj_now()
-    if not _is_trade_day(now_bj.date(), trade_days):
+    if not cal.is_trading_day(now_bj.date()):
         return df_final
 
     df_final = _trim_future_rows(df_final, now_bj)
     if df_final.empty:
         return df_final
 
-    expected = _last_completed_bar_end(now_bj, tf_min, trade_days).replace(tzinfo=None)
+    expected = cal.last_completed_bar_end(now_bj, tf_min)
     last_ts = pd.to_datetime(df_final["date"].max(), errors="coerce")
     if pd.isna(last_ts):
         return df_final
 
-    lag_min = int((expected - last_ts).total_seconds() // 60)
+    # 按交易分钟计算滞后（午休/隔夜不计入）
+    lag_min = cal.trading_minutes_between(last_ts.to_pydatetime(), expected)
     tol_min = max(7, tf_min * 2)
     if lag_min <= tol_min:
         return df_final
 
+    patched = _patch_from_snapshot(symbol_code, tf_min, df_final, last_ts.to_pydatetime(), expected, now_bj)
+    if patched is not None:
+        return patched.tail(limit).reset_index(drop=True) if len(patched) > limit else patched
+
+    # 只补拉尾部缺口 (last, expected]，而不是固定 7 天
     print(f"    ⚠️ 数据可能不够新: last={last_ts} expected~={expected} (lag={lag_min}m). 尝试 AkShare 补拉...", flush=True)
-    df_recent = _refresh_akshare_recent(symbol_code, tf_min, start_days_back=7)
+    df_recent = _refresh_akshare_recent(symbol_code, tf_min, last_ts.to_pydatetime(), expected)
     if df_recent.empty:
         return df_final
+    df_recent = _VOLUME_UNITS.normalize(symbol_code, "akshare", df_recent, df_final)
 
-    df_merged = pd.concat([df_final, df_recent], axis=0, ignore_index=True)
-    df_merged = df_merged.drop_duplicates(subset=["date"], keep="last").sort_values("date").reset_index(drop=True)
+    df_merged, _ = _merge_on_grid([df_final, df_recent], tf_min)
     df_merged = _trim_future_rows(df_merged, now_bj)
     if len(df_merged) > limit:
         df_merged = df_merged.tail(limit).reset_index(drop=True)
 
     last_ts2 = pd.to_datetime(df_merged["date"].max(), errors="coerce")
-    lag_min2 = int((expected - last_ts2).total_seconds() // 60) if not pd.isna(last_ts2) else 10**9
+    lag_min2 = cal.trading_minutes_between(last_ts2.to_pydatetime(), expected) if not pd.isna(last_ts2) else 10**9
     if lag_min2 > tol_min and _parse_bool_env("REQUIRE_FRESH_DATA", True):
         print(f"    ❌ 补拉后仍不新鲜: last={last_ts2} expected~={expected} (lag={lag_min2}m). 跳过该股票避免误判。", flush=True)
         return pd.DataFrame()
     return df_merged
 
+# ==========================================
+# 批量新鲜度补丁：每次运行一次全市场快照，覆盖整张关注表
+# ==========================================
+
+_SPOT_POOL: Optional[ThreadPoolExecutor] = None
+_SPOT_FUTURE: Optional[Future] = None
+
+def _fetch_spot_snapshot(symbols: set[str]) -> dict[str, dict]:
+    """One stock_zh_a_spot_em call -> {symbol: day open/high/low/last/volume(shares)} for the watchlist."""
+    _AK_RATE.acquire()
+    try:
+        with _SOURCE_LIMITS["akshare"]:
+            spot = ak.stock_zh_a_spot_em()
+        _AK_RATE.on_success()
+    except Exception as e:
+        if is_throttle_error(e):
+            _AK_RATE.on_throttle()
+        print(f"    ⚠️ 全市场快照获取失败: {str(e)[:120]}", flush=True)
+        return {}
+
+    spot = spot[spot["代码"].astype(str).isin(symbols)]
+    cols = {"最新价": "close", "今开": "open", "最高": "high", "最低": "low", "成交量": "volume"}
+    spot = spot.rename(columns=cols)
+    for c in cols.values():
+        spot[c] = pd.to_numeric(spot[c], errors="coerce")
+    spot["volume"] = spot["volume"] * 100  # 东财快照成交量单位为“手”
+    return spot.set_index(spot["代码"].astype(str))[list(cols.values())].to_dict("index")
+
+def _start_fresh_tail_stage(items: list[tuple[str, dict]]) -> None:
+    """Kicks off the snapshot in the background so it never sits on a stock's critical path."""
+    global _SPOT_POOL, _SPOT_FUTURE
+    if not _parse_bool_env("FRESH_TAIL_SNAPSHOT", True):
+        return
+    if not get_trade_calendar().is_trading_day(_bj_now().date()):
+        return
+    symbols = {''.join(filter(str.isdigit, str(sym))).zfill(6) for sym, _ in items}
+    _SPOT_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spot")
+    _SPOT_FUTURE = _SPOT_POOL.submit(_fetch_spot_snapshot, symbols)
+    _SPOT_POOL.shutdown(wait=False)
+
+def _patch_from_snapshot(symbol_code: str, tf_min: int, df_final: pd.DataFrame,
+                         last_ts: datetime, expected: datetime, now_bj: datetime) -> Optional[pd.DataFrame]:
+    """
+    Patches a stale tail from the run-wide snapshot instead of re-downloading bars.
+    Suspended symbols (zero volume today) are fresh as-is. Otherwise exactly one missing bar
+    becomes a provisional bar labelled `expected`, built from the day's cumulative OHLCV minus
+    what the frame already holds.
+    Provisional bars are never written to the bar store. Returns None if the patch can't apply.
+    """
+    if _SPOT_FUTURE is None:
+        return None
+    try:
+        snap = _SPOT_FUTURE.result().get(symbol_code)
+    except Exception:
+        return None
+    if not snap or pd.isna(snap.get("close")):
+        return None
+
+    if not snap.get("volume"):
+        print(f"    ℹ️ [{symbol_code}] 今日无成交（停牌），沿用已有数据", flush=True)
+        return df_final
+
+    cal = get_trade_calendar()
+    # 盘中快照包含未收盘的 bar，只能在午休/收盘后使用
+    if cal.trading_minutes_between(expected, now_bj.replace(tzinfo=None)) > 0:
+        return None
+    # 只补一根：多根缺失合成一根会把整段成交量压进一根 bar，扭曲量能 z-score、事件识别与图表，改走增量补拉
+    if cal.trading_minutes_between(last_ts, expected) // tf_min != 1:
+        return None
+
+    day_start = datetime.combine(expected.date(), datetime.min.time())
+    dates = df_final["date"]
+    today = df_final[dates >= day_start]
+    vol = float(snap["volume"]) - float(today["volume"].sum())
+    if vol < 0:
+        return None
+    close = float(snap["close"])
+    if today.empty:
+        o, h, lo = float(snap["open"]), float(snap["high"]), float(snap["low"])
+    else:
+        o = float(df_final["close"].iloc[-1])
+        # 当日新高/新低若出现在缺失区间内，快照的日内极值就是该 bar 的极值
+        h = max(o, close, float(snap["high"]) if snap["high"] > today["high"].max() else close)
+        lo = min(o, close, float(snap["low"]) if snap["low"] < today["low"].min() else close)
+
+    bar = pd.DataFrame({"date": [pd.Timestamp(expected)], "open": [o], "high": [h], "low": [lo], "close": [close], "volume": [vol]})
+    out = pd.concat([df_final, bar], ignore_index=True)
+    # 临时 bar 只用于本次分析，_persist_bars 据此过滤
+    out.attrs["provisional_after"] = pd.Timestamp(last_ts)
+    print(f"    🩹 [{symbol_code}] 用全市场快照补齐尾部 (1 根临时 bar @ {expected})", flush=True)
+    return out
+
 def _run_state_path() -> str:
     os.makedirs("data", exist_ok=True)
     return os.path.join("data", "run_state.json")
@@ -248,8 +318,7 @@ def _schedule_gate() -> str | None:
         return "manual"
 
     now_bj = _bj_now()
-    trade_days = _load_trade_calendar()
-    if not _is_trade_day(now_bj.date(), trade_days):
+    if not get_trade_calendar().is_trading_day(now_bj.date()):
         print(f"⏭️ 非交易日 {now_bj.date()}，跳过运行。", flush=True)
         return None
 
@@ -289,7 +358,11 @@ class GeminiRateLimited(Exception):
     pass
 
 class GeminiFatalError(Exception):
-    """致命错误（如 API Key 无效）：绝对不可重试。"""
+    """致命错误（如请求参数无效）：绝对不可重试。"""
+    pass
+
+class GeminiAuthError(GeminiFatalError):
+    """API Key 无效 / 无权限：每只股票都会重复出现，打开熔断。"""
     pass
 
 def _extract_retry_seconds(resp: requests.Response) -> int:
@@ -317,20 +390,56 @@ def _is_quota_exhausted(resp: requests.Response) -> bool:
     except: pass
     return False
 
+# 对冲请求线程的取消信号（_start_provider 设置）：落败的一方据此关闭流、停止重试
+_LLM_CALL = threading.local()
+
+def _call_cancel() -> Optional[threading.Event]:
+    return getattr(_LLM_CALL, "cancel", None)
+
+def _stream_text(provider: str, chunks, close) -> str:
+    """Drains a streamed completion with TTFT / stall timeouts; records TTFT and tokens/sec per provider."""
+    ttft_s, stall_s = stream_timeouts()
+    try:
+        res = consume(chunks, ttft_s, stall_s, close, _call_cancel())
+    except StreamStalled as e:
+        STREAM_STATS.record_stall(provider)
+        print(f"    ⏱️ {provider} 流式输出中断: {e}", flush=True)
+        raise
+    STREAM_STATS.record(provider, res, estimate_tokens(res.text))
+    return res.text
+
+def _gemini_sse_chunks(resp):
+    """Text parts from a streamGenerateContent?alt=sse response (thought parts skipped)."""
+    resp.encoding = "utf-8"
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        payload = json.loads(line[5:])
+        for cand in (payload.get("candidates") or [])[:1]:
+            for part in (cand.get("content") or {}).get("parts") or []:
+                if not part.get("thought"):
+                    yield part.get("text", "")
+
+def _openai_chunks(stream):
+    for chunk in stream:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
 def call_gemini_http(prompt: str) -> str:
     """第一优先级：Google 官方 API"""
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key: raise ValueError("GEMINI_API_KEY missing")
 
     model_name = os.getenv("GEMINI_MODEL") or "gemini-3-flash-preview"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
+    # LLM_STREAM_ENABLED：流式接口，首 token / 停顿超时后立即放弃（GEMINI_TIMEOUT 仅作兜底）
+    stream = _parse_bool_env("LLM_STREAM_ENABLED", True)
+    method = "streamGenerateContent?alt=sse&" if stream else "generateContent?"
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:{method}key={api_key}"
 
-    session = requests.Session()
-    
+    # 进程内复用的连接池；只有出现过 RemoteDisconnected 的 host 才退回 Connection: close
     headers = {
         "Content-Type": "application/json",
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Connection": "close"
     }
 
     safety_settings = [
@@ -353,8 +462,14 @@ def call_gemini_http(prompt: str) -> str:
     last_err: Optional[Exception] = None
 
     for attempt in range(1, max_retries + 1):
+        cancel = _call_cancel()
+        if cancel is not None and cancel.is_set():
+            raise StreamCancelled("gemini request abandoned")
         try:
-            resp = session.post(url, headers=headers, json=data, timeout=timeout_s)
+            resp = CLIENTS.request("gemini", "POST", url, headers=headers, json=data, timeout=timeout_s, stream=stream)
+
+            if resp.status_code == 200 and stream:
+                return _stream_text("gemini", _gemini_sse_chunks(resp), resp.close)
 
             if resp.status_code == 200:
                 result = resp.json()
@@ -363,8 +478,12 @@ def call_gemini_http(prompt: str) -> str:
                 except:
                     raise ValueError(f"Invalid response: {str(result)[:200]}")
             
+            # Key 无效时 Gemini 返回 400 + API_KEY_INVALID；其余 400 只是本次请求（prompt）的问题
+            if resp.status_code in (401, 403) or (resp.status_code == 400 and "API_KEY_INVALID" in resp.text):
+                raise GeminiAuthError(f"Gemini Auth Error ({resp.status_code}): {resp.text[:200]}")
+
             if resp.status_code == 400:
-                raise GeminiFatalError(f"Gemini Key/Params Error (400): {resp.text[:200]}")
+                raise GeminiFatalError(f"Gemini Params Error (400): {resp.text[:200]}")
 
             if resp.status_code == 429:
                 if _is_quota_exhausted(resp):
@@ -391,6 +510,7 @@ def call_gemini_http(prompt: str) -> str:
 
         except GeminiFatalError: raise 
         except GeminiQuotaExceeded: raise 
+        except (StreamStalled, StreamCancelled): raise
         except Exception as e:
             last_err = e
             if attempt == max_retries: raise
@@ -411,122 +531,71 @@ def _get_baostock_code(symbol: str) -> str:
     if symbol.startswith("8") or symbol.startswith("4"): return f"bj.{symbol}"
     return f"sz.{symbol}"
 
-def _detect_and_fix_volume_units(df_bs: pd.DataFrame, df_ak: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
-    if df_bs.empty and not df_ak.empty:
-        v = df_ak["volume"].dropna()
-        if len(v) < 50:
-            df_ak = df_ak.copy()
-            df_ak["volume"] *= 100
-            return df_bs, df_ak
-        mod100 = float((v % 100 == 0).mean())
-        if mod100 > 0.9:
-            return df_bs, df_ak
-        df_ak = df_ak.copy()
-        df_ak["volume"] *= 100
-        return df_bs, df_ak
-
-    if df_bs.empty or df_ak.empty:
-        return df_bs, df_ak
-
-    a = df_bs[["date", "volume"]].dropna()
-    b = df_ak[["date", "volume"]].dropna()
-    m = a.merge(b, on="date", how="inner", suffixes=("_bs", "_ak"))
-    m = m[(m["volume_bs"] > 0) & (m["volume_ak"] > 0)]
-
-    if len(m) < 10: 
-        return df_bs, df_ak
-
-    m = m.tail(200) 
-    ratio_med = float((m["volume_bs"] / m["volume_ak"]).median())
-
-    def _in(r, center, tol=0.25):
-        return (center*(1-tol)) <= r <= (center*(1+tol))
-
-    df_ak = df_ak.copy() 
-    df_bs = df_bs.copy()
-
-    if _in(ratio_med, 1000):
-        df_ak["volume"] *= 1000
-    elif _in(ratio_med, 100):
-        df_ak["volume"] *= 100
-    elif _in(ratio_med, 0.001):
-        df_bs["volume"] *= 1000
-    elif _in(ratio_med, 0.01):
-        df_bs["volume"] *= 100
-    return df_bs, df_ak
-
-def fetch_stock_data_dynamic(symbol: str, timeframe_str: str, bar_count_str: str) -> dict:
-    clean_digits = ''.join(filter(str.isdigit, str(symbol)))
-    symbol_code = clean_digits.zfill(6)
-    
-    try: tf_min = int(timeframe_str)
-    except: tf_min = 5
-    
-    try: limit = int(bar_count_str)
-    except: limit = 500
-
-    if tf_min not in [1, 5, 15, 30, 60]:
-        tf_min = 60
-    
-    total_minutes = limit * tf_min
-    days_back = int((total_minutes / 240) * 2.5) + 10 
-    
-    start_date_dt = datetime.now() - timedelta(days=days_back)
-    start_date_str = start_date_dt.strftime("%Y-%m-%d")
-    start_date_ak_str = start_date_dt.strftime("%Y%m%d")
-    
-    source_msg = "AkShare Only" if tf_min == 1 else "BaoStock+AkShare"
-    print(f"    🔍 获取 {symbol_code}: 周期={tf_min}m, 目标={limit}根 ({source_msg})", flush=True)
-
-    # === A. BaoStock 历史 ===
-    df_bs = pd.DataFrame()
-    if tf_min >= 5:
-        try:
-            bs_code = _get_baostock_code(symbol_code)
-            lg = bs.login()
-            if lg.error_code == '0':
-                rs = bs.query_history_k_data_plus(
-                    bs_code, "date,time,open,high,low,close,volume",
-                    start_date=start_date_str, end_date=datetime.now().strftime("%Y-%m-%d"),
-                    frequency=str(tf_min), adjustflag="3"
-                )
-                if rs.error_code == '0':
-                    data_list = []
-                    while rs.next(): data_list.append(rs.get_row_data())
-                    df_bs = pd.DataFrame(data_list, columns=rs.fields)
-                    
-                    if not df_bs.empty:
-                        df_bs["date"] = pd.to_datetime(df_bs["time"], format="%Y%m%d%H%M%S000", errors="coerce")
-                        df_bs = df_bs.drop(columns=["time"], errors="ignore")
-                        cols = ["open", "high", "low", "close", "volume"]
-                        for c in cols: df_bs[c] = pd.to_numeric(df_bs[c], errors="coerce")
-                        df_bs = df_bs.dropna(subset=["date", "close"])
-                        df_bs = df_bs[["date", "open", "high", "low", "close", "volume"]]
-            bs.logout()
-        except Exception as e:
-            print(f"    [BaoStock] 异常: {e}", flush=True)
+# 成交量单位 (手/股) 按 symbol + 数据源缓存；BaoStock 分钟线为“股”，作为参照（_load_heavy_modules 创建）
+_VOLUME_UNITS: Optional[VolumeUnitCalibrator] = None
+
+# 每个数据源的并发上限（取代逐股 30s 强制冷却）。
+# BaoStock 客户端是进程级全局 socket，由 BaoStockSession 内部锁串行；AkShare(Eastmoney) 允许少量并发。
+_SOURCE_LIMITS = {
+    "akshare": threading.BoundedSemaphore(max(1, int(os.getenv("AKSHARE_CONCURRENCY", "2")))),
+}
+
+# 自适应 (AIMD) 速率：成功则加性提速，被掐断连接则乘性降速；学到的速率写入 run_state.json
+_AK_RATE = RATE_LIMITS.register(
+    "akshare",
+    rate=float(os.getenv("AKSHARE_RATE", "0.5")),
+    min_rate=float(os.getenv("AKSHARE_MIN_RATE", "0.05")),
+    max_rate=float(os.getenv("AKSHARE_MAX_RATE", "4")),
+)
+_BS_RATE = RATE_LIMITS.register("baostock", rate=5.0, min_rate=0.2, max_rate=20.0, increase=0.5)
+
+# 整个运行期只登录一次 BaoStock；main() 会把整张关注表的查询批量预取到 _BS_PREFETCH
+_BS_SESSION: Optional[BaoStockSession] = None
+_BS_PREFETCH: dict[tuple, Future] = {}
+
+def _fetch_baostock(symbol_code: str, tf_min: int, start_date_str: str, end_date_str: Optional[str] = None) -> pd.DataFrame:
+    job = (_get_baostock_code(symbol_code), tf_min, start_date_str, end_date_str)
+    fut = _BS_PREFETCH.pop(job, None)
+    try:
+        if fut is not None:
+            return fut.result()
+        return _BS_SESSION.query_bars(*job)
+    except Exception as e:
+        print(f"    [BaoStock] 异常: {e}", flush=True)
+        return pd.DataFrame()
 
-    # === B. AkShare 数据 (增加稳定性重试逻辑) ===
-    ak_fetch_start = start_date_ak_str if tf_min == 1 else (datetime.now() - timedelta(days=20)).strftime("%Y%m%d")
+def _prefetch_baostock(items: list[tuple[str, dict]]) -> None:
+    """Queues every watchlist BaoStock query on the shared session in one batch."""
+    jobs = []
+    for symbol, info in items:
+        info = info or {}
+        plan = _plan_fetch(symbol, info.get("timeframe", "5"), info.get("bars", "500"))
+        if plan["bs_range"]:
+            jobs.append((_get_baostock_code(plan["symbol_code"]), plan["tf_min"], *plan["bs_range"]))
+    if jobs:
+        _BS_PREFETCH.update(_BS_SESSION.submit_batch(list(dict.fromkeys(jobs))))
+
+def _fetch_akshare(symbol_code: str, tf_min: int, ak_fetch_start: str) -> pd.DataFrame:
+    """AkShare 数据 (增加稳定性重试逻辑)"""
     df_ak = pd.DataFrame()
     
     max_ak_retries = 3
     for ak_attempt in range(1, max_ak_retries + 1):
         try:
-            # 1. 模拟人工：请求前随机微调 1-3 秒
-            time.sleep(random.uniform(1.0, 3.0))
-            
-            df_temp = ak.stock_zh_a_hist_min_em(symbol=symbol_code, period=str(tf_min), start_date=ak_fetch_start, adjust="qfq")
+            # 1. 按自适应速率排队（取代固定的 1-3 秒随机等待）
+            _AK_RATE.acquire()
+            with _SOURCE_LIMITS["akshare"]:
+                df_temp = ak.stock_zh_a_hist_min_em(symbol=symbol_code, period=str(tf_min), start_date=ak_fetch_start, adjust="qfq")
+            _AK_RATE.on_success()
             
             if not df_temp.empty:
                 df_ak = df_temp
                 break # 成功则退出重试
         except Exception as e:
             err_msg = str(e)
-            if "RemoteDisconnected" in err_msg or "Connection aborted" in err_msg:
-                wait_s = ak_attempt * 5 + random.random()
-                print(f"    ⚠️ AkShare 连接中断 ({ak_attempt}/{max_ak_retries})，等待 {wait_s:.1f}s 重试...", flush=True)
-                time.sleep(wait_s)
+            if is_throttle_error(e):
+                _AK_RATE.on_throttle()
+                print(f"    ⚠️ AkShare 连接中断 ({ak_attempt}/{max_ak_retries})，降速后重试...", flush=True)
             else:
                 print(f"    [AkShare] 未知异常: {err_msg}", flush=True)
                 break
@@ -544,21 +613,238 @@ def fetch_stock_data_dynamic(symbol: str, timeframe_str: str, bar_count_str: str
         df_ak["open"] = df_ak["open"].fillna(df_ak["close"].shift(1)).fillna(df_ak["close"])
         df_ak = df_ak.dropna(subset=["date", "close"])
         df_ak = df_ak[["date", "open", "high", "low", "close", "volume"]]
+    return df_ak
+
+def _merge_on_grid(frames: list[pd.DataFrame], tf_min: int) -> tuple[pd.DataFrame, Optional[BarGrid]]:
+    """
+    Merges sources by scattering them onto the calendar's bar grid (later frames win).
+    Falls back to sort + dedupe if any bar is off the grid (e.g. the calendar fell back to weekdays).
+    """
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame(), None
+    start = min(f["date"].min() for f in frames)
+    end = max(f["date"].max() for f in frames)
+    grid = BarGrid(get_trade_calendar(), start.date(), end.date(), tf_min)
+    off_grid = sum(grid.scatter(f) for f in frames)
+    if off_grid:
+        print(f"    ⚠️ {off_grid} 根 K 线不在 {tf_min}m 交易时间网格上，按时间排序去重合并", flush=True)
+        df = pd.concat(frames, axis=0, ignore_index=True)
+        df = df.drop_duplicates(subset=["date"], keep="last").sort_values("date").reset_index(drop=True)
+        return df, None
+    return grid.frame(), grid
+
+def _fill_gaps(symbol_code: str, tf_min: int, df_final: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reports every missing bar inside the window and re-pulls only the missing span.
+    Whole-day gaps (suspensions) and gaps older than GAP_REFETCH_DAYS trading days are reported only.
+    """
+    if df_final.empty or not _parse_bool_env("GAP_REFETCH_ENABLED", True):
+        return df_final
+    _, grid = _merge_on_grid([df_final], tf_min)
+    if grid is None:
+        return df_final
+    gaps = grid.gaps()
+    if not gaps:
+        return df_final
+
+    whole_days = [g for g in gaps if g.whole_day]
+    print(f"    🕳️ [{symbol_code}] {tf_min}m 发现 {len(gaps)} 处缺口，共 {sum(g.bars for g in gaps)} 根"
+          f"（其中整日缺失 {len(whole_days)} 处，疑似停牌）", flush=True)
+    refetch_days = max(1, int(os.getenv("GAP_REFETCH_DAYS", "5")))
+    today = _bj_now().date()
+    horizon = prev_trading_day_or_weekday(get_trade_calendar(), today, refetch_days - 1) if refetch_days > 1 else today
+    todo = [g for g in gaps if not g.whole_day and g.start.date() >= horizon]
+    if not todo:
+        return df_final
+
+    # AkShare 按时间区间过滤，一次请求覆盖所有近期缺口
+    df_fix = _refresh_akshare_recent(symbol_code, tf_min, todo[0].start.to_pydatetime(), todo[-1].end.to_pydatetime())
+    if df_fix.empty:
+        return df_final
+    df_fix = _VOLUME_UNITS.normalize(symbol_code, "akshare", df_fix, df_final)
+    before = int(grid.filled.sum())
+    grid.scatter(df_fix, only_missing=True)
+    filled = int(grid.filled.sum()) - before
+    if filled == 0:
+        return df_final
+
+    df_filled = grid.frame()
+    if _BAR_STORE_ENABLED:
+        _BAR_STORE.merge(symbol_code, tf_min, df_filled[df_filled["date"].isin(df_fix["date"])])
+    remaining = sum(g.bars for g in grid.gaps())
+    print(f"    🩹 [{symbol_code}] 缺口补拉 {filled} 根，剩余缺失 {remaining} 根", flush=True)
+    return df_filled
+
+_BAR_STORE: Optional[BarStore] = None
+_BAR_STORE_ENABLED = _parse_bool_env("BAR_STORE_ENABLED", True)
+
+def _persist_bars(symbol_code: str, tf_min: int, df_final: pd.DataFrame, df_stored: pd.DataFrame) -> None:
+    """Writes bars that _ensure_latest_data refreshed beyond what the store already holds."""
+    if not _BAR_STORE_ENABLED or df_final.empty:
+        return
+    provisional_after = df_final.attrs.get("provisional_after")
+    if provisional_after is not None:
+        df_final = df_final[df_final["date"] <= provisional_after]
+        if df_final.empty:
+            return
+    if not df_stored.empty and df_final["date"].max() <= df_stored["date"].max():
+        return
+    _BAR_STORE.merge(symbol_code, tf_min, df_final)
+
+def _plan_fetch(symbol: str, timeframe_str: str, bar_count_str: str) -> dict:
+    """Works out the fetch window for one row; shared by the fetcher and the BaoStock batch prefetch."""
+    clean_digits = ''.join(filter(str.isdigit, str(symbol)))
+    symbol_code = clean_digits.zfill(6)
+    
+    # 支持 "5" 或 "5,30" / "5/30/60"：只抓最小周期，其余周期本地重采样
+    timeframes = parse_timeframes(timeframe_str)
+    tf_min = timeframes[0]
+    
+    try: bars = int(bar_count_str)
+    except: bars = 500
+
+    # 基础周期需要覆盖最大周期的 bars 根
+    limit = max(bars * tf // tf_min for tf in timeframes)
+    
+    cal = get_trade_calendar()
+    now_bj = _bj_now().replace(tzinfo=None)
+    today = now_bj.date()
+    bars_per_day = SESSION_MINUTES // tf_min + (1 if tf_min == 1 else 0)
+
+    # 最后一个有已收盘 bar 的交易日；若今天盘中，今天只贡献部分 bar
+    last_day = cal.last_completed_bar_end(now_bj, tf_min).date()
+    today_bars = 0
+    if last_day == today:
+        today_bars = cal.trading_minutes_between(datetime.combine(today, datetime.min.time()), now_bj) // tf_min
+    days_needed = max(1, -(-max(0, limit - today_bars) // bars_per_day) + (1 if today_bars else 0))
+    start_day = prev_trading_day_or_weekday(cal, last_day, days_needed - 1) if days_needed > 1 else last_day
+
+    # BaoStock 分钟线在交易日晚间才入库：之前只能覆盖到上一交易日
+    bs_ready = _hhmm_to_time(os.getenv("BAOSTOCK_READY_HHMM", "2030"))
+    if cal.is_trading_day(today) and (now_bj.hour, now_bj.minute) >= bs_ready:
+        bs_last_day = today
+    else:
+        bs_last_day = prev_trading_day_or_weekday(cal, today)
+
+    # 本地仓库已有足够历史时，只增量拉取最后一根之后的数据（从最后一天起拉，保留当天重叠用于单位校准）
+    incremental = _BAR_STORE_ENABLED and _BAR_STORE.count(symbol_code, tf_min) >= limit
+    if incremental:
+        last_ts = _BAR_STORE.last_timestamp(symbol_code, tf_min).to_pydatetime()
+        stored_day = last_ts.date()
+        day_complete = (last_ts.hour, last_ts.minute) >= (15, 0)
+        bs_start = next_trading_day_or_weekday(cal, stored_day) if day_complete else stored_day
+        ak_start = stored_day
+    elif tf_min == 1:
+        # 1m 无 BaoStock，全部由 AkShare 提供
+        bs_start = ak_start = start_day
+    else:
+        bs_start = start_day
+        # AkShare 只补 BaoStock 覆盖不到的部分，外加够单位校准用的重叠（约 10 根）
+        overlap_days = -(-10 // bars_per_day)
+        overlap_start = prev_trading_day_or_weekday(cal, bs_last_day, overlap_days - 1) if overlap_days > 1 else bs_last_day
+        ak_start = max(start_day, overlap_start)
+
+    if tf_min == 1:
+        bs_range = None
+    elif bs_start <= bs_last_day:
+        bs_range = (bs_start.strftime("%Y-%m-%d"), bs_last_day.strftime("%Y-%m-%d"))
+    else:
+        bs_range = None
+
+    return {
+        "symbol_code": symbol_code,
+        "tf_min": tf_min,
+        "timeframes": timeframes,
+        "bars": bars,
+        "limit": limit,
+        "incremental": incremental,
+        "bs_range": bs_range,
+        "ak_fetch_start": ak_start.strftime("%Y%m%d"),
+        # BaoStock 失败时 AkShare 从这里重拉完整窗口
+        "ak_full_start": start_day.strftime("%Y%m%d"),
+    }
+
+def fetch_stock_data_dynamic(symbol: str, timeframe_str: str, bar_count_str: str) -> dict:
+    plan = _plan_fetch(symbol, timeframe_str, bar_count_str)
+    symbol_code = plan["symbol_code"]
+    tf_min = plan["tf_min"]
+    limit = plan["limit"]
+    incremental = plan["incremental"]
+    ak_fetch_start = plan["ak_fetch_start"]
+    df_stored = _BAR_STORE.load(symbol_code, tf_min) if incremental else pd.DataFrame()
+    
+    if plan["bs_range"]:
+        source_msg = f"BaoStock {plan['bs_range'][0]}~{plan['bs_range'][1]} + AkShare since {ak_fetch_start}"
+    else:
+        source_msg = f"AkShare Only since {ak_fetch_start}"
+    if incremental:
+        source_msg += ", 增量"
+    print(f"    🔍 获取 {symbol_code}: 周期={tf_min}m, 目标={limit}根 ({source_msg})", flush=True)
+
+    # === A/B. BaoStock 历史 + AkShare 近期：两个数据源并行拉取 ===
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fut_bs = ex.submit(_fetch_baostock, symbol_code, tf_min, *plan["bs_range"]) if plan["bs_range"] else None
+        fut_ak = ex.submit(_fetch_akshare, symbol_code, tf_min, ak_fetch_start)
+        df_bs = fut_bs.result() if fut_bs is not None else pd.DataFrame()
+        df_ak = fut_ak.result()
+
+    # BaoStock 失败或为空：AkShare 只拉了最近几天，回退为 AkShare 拉取完整窗口
+    if df_bs.empty and not incremental and plan["ak_full_start"] < ak_fetch_start:
+        print(f"    ⚠️ BaoStock 无数据，AkShare 改为从 {plan['ak_full_start']} 拉取完整窗口", flush=True)
+        df_full = _fetch_akshare(symbol_code, tf_min, plan["ak_full_start"])
+        if not df_full.empty:
+            df_ak = df_full
 
     # === C. 合并与单位修正 ===
     if df_bs.empty and df_ak.empty:
-        return {"df": pd.DataFrame(), "period": f"{tf_min}m"}
+        if incremental:
+            print(f"    ⚠️ 增量拉取为空，使用本地仓库数据", flush=True)
+            df_final = df_stored.tail(limit).reset_index(drop=True)
+            df_final = _fill_gaps(symbol_code, tf_min, df_final)
+            df_final = _ensure_latest_data(symbol_code, tf_min, limit, df_final)
+            _persist_bars(symbol_code, tf_min, df_final, df_stored)
+            return _build_frames(df_final, plan)
+        return _build_frames(pd.DataFrame(), plan)
     
-    df_bs, df_ak = _detect_and_fix_volume_units(df_bs, df_ak)
-    df_final = pd.concat([df_bs, df_ak], axis=0, ignore_index=True)
-    df_final = df_final.drop_duplicates(subset=['date'], keep='last')
-    df_final = df_final.sort_values(by='date').reset_index(drop=True)
+    # 增量模式下 AkShare 与仓库中已校准的历史重叠；全量模式下与 BaoStock 重叠
+    df_ref = df_stored if incremental else df_bs
+    df_ak = _VOLUME_UNITS.normalize(symbol_code, "akshare", df_ak, df_ref)
+    df_final, _ = _merge_on_grid([df_bs, df_ak], tf_min)
+
+    if _BAR_STORE_ENABLED:
+        # 未收盘的 bar 不入库
+        df_final = _trim_future_rows(df_final, _bj_now())
+        df_final = _BAR_STORE.merge(symbol_code, tf_min, df_final)
+        df_stored = df_final
     
     if len(df_final) > limit:
         df_final = df_final.tail(limit).reset_index(drop=True)
+    df_final = _fill_gaps(symbol_code, tf_min, df_final)
     # 校验是否为最新数据；若落后则尝试 AkShare 补拉最近几天再合并
     df_final = _ensure_latest_data(symbol_code, tf_min, limit, df_final)
-    return {"df": df_final, "period": f"{tf_min}m"}
+    if len(df_final) < limit:
+        print(f"    ⚠️ [{symbol_code}] 仅获取到 {len(df_final)}/{limit} 根 {tf_min}m K 线，按现有数据分析", flush=True)
+    _persist_bars(symbol_code, tf_min, df_final, df_stored)
+    return _build_frames(df_final, plan)
+
+def _build_frames(df_base: pd.DataFrame, plan: dict) -> dict:
+    """
+    Derives every requested timeframe from the base series (session-aware resampling).
+    'df'/'period' stay the base timeframe; 'frames' maps period -> frame for multi-timeframe reports.
+    """
+    base = plan["tf_min"]
+    bars = plan["bars"]
+    frames = {}
+    for tf in plan["timeframes"]:
+        if df_base.empty:
+            break
+        df_tf = df_base if tf == base else resample_bars(df_base, base, tf)
+        if not df_tf.empty:
+            frames[f"{tf}m"] = df_tf.tail(bars).reset_index(drop=True)
+    period = "-".join(frames) if len(frames) > 1 else f"{base}m"
+    df = frames.get(f"{base}m", pd.DataFrame())
+    return {"df": df, "period": period, "frames": frames}
 
 def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
@@ -567,29 +853,41 @@ def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
         df["ma200"] = df["close"].rolling(200).mean()
     return df
 
+def _wyckoff_events(symbol: str, df: pd.DataFrame) -> str:
+    """Rule-based Wyckoff event table for the prompt ('' when disabled or too few bars)."""
+    if not _parse_bool_env("WYCKOFF_FEATURES_ENABLED", True):
+        return ""
+    try:
+        t0 = time.perf_counter()
+        events, summary = detect_events(df)
+        text = format_events(events, summary)
+        if text:
+            print(f"    🧭 [{symbol}] 威科夫事件候选 {len(events)} 个 ({(time.perf_counter() - t0) * 1000:.1f} ms)", flush=True)
+        return text
+    except Exception as e:
+        print(f"    ⚠️ [{symbol}] 事件检测失败: {e}", flush=True)
+        return ""
+
 # ==========================================
 # 2. 绘图模块
 # ==========================================
 
-def generate_local_chart(symbol: str, df: pd.DataFrame, save_path: str, period: str):
-    if df.empty: return
-    plot_df = df.copy()
-    if "date" in plot_df.columns: plot_df.set_index("date", inplace=True)
-
-    mc = mpf.make_marketcolors(up='#ff3333', down='#00b060', edge='inherit', wick='inherit', volume={'up': '#ff3333', 'down': '#00b060'}, inherit=True)
-    s = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=mc, gridstyle=':', y_on_right=True)
-    apds = []
-    if 'ma50' in plot_df.columns: apds.append(mpf.make_addplot(plot_df['ma50'], color='#ff9900', width=1.5))
-    if 'ma200' in plot_df.columns: apds.append(mpf.make_addplot(plot_df['ma200'], color='#2196f3', width=2.0))
+# 绘图进程池：worker 启动时预加载 mplfinance 与样式（spawn，不继承抓取线程持有的锁），整个运行期间复用
+_CHART_POOL: Optional[ProcessPoolExecutor] = None
 
-    try:
-        mpf.plot(plot_df, type='candle', style=s, addplot=apds, volume=True, 
-                 title=f"Wyckoff: {symbol} ({period} | {len(plot_df)} bars)", 
-                 savefig=dict(fname=save_path, dpi=150, bbox_inches='tight'), 
-                 warn_too_much_data=2000)
-    except Exception as e:
-        print(f"    [Error] 绘图失败: {e}", flush=True)
+def _chart_pool() -> ProcessPoolExecutor:
+    global _CHART_POOL
+    if _CHART_POOL is None:
+        _CHART_POOL = ProcessPoolExecutor(max_workers=_env_workers("CHART_WORKERS", os.cpu_count() or 1),
+                                          mp_context=multiprocessing.get_context("spawn"),
+                                          initializer=charts.init_worker)
+    return _CHART_POOL
 
+def _shutdown_chart_pool() -> None:
+    global _CHART_POOL
+    if _CHART_POOL is not None:
+        _CHART_POOL.shutdown(wait=True)
+        _CHART_POOL = None
 
 # ==========================================
 # 3. AI 分析模块 (三级兜底)
@@ -597,7 +895,22 @@ def generate_local_chart(symbol: str, df: pd.DataFrame, save_path: str, period:
 
 _PROMPT_CACHE = None
 
-def get_prompt_content(symbol, df, position_info):
+def _period_minutes(period) -> int:
+    digits = "".join(ch for ch in str(period) if ch.isdigit())
+    return int(digits) if digits else 5
+
+def _prompt_token_budget() -> int:
+    """
+    Token budget for the bar data. The prompt is shared by the whole fallback chain, so it is the
+    smallest PROMPT_TOKEN_BUDGET_<PROVIDER> among providers with a key (PROMPT_TOKEN_BUDGET otherwise); 0 = unlimited.
+    """
+    default = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+    keys = {"GEMINI": "GEMINI_API_KEY", "CUSTOM": "CUSTOM_API_KEY", "OPENAI": "OPENAI_API_KEY"}
+    budgets = [int(os.getenv(f"PROMPT_TOKEN_BUDGET_{p}", str(default))) for p, k in keys.items() if os.getenv(k)]
+    budgets = [b for b in budgets if b > 0]
+    return min(budgets) if budgets else max(default, 0)
+
+def _prompt_template() -> Optional[str]:
     global _PROMPT_CACHE
     if _PROMPT_CACHE is None:
         prompt_template = os.getenv("WYCKOFF_PROMPT_TEMPLATE")
@@ -606,18 +919,44 @@ def get_prompt_content(symbol, df, position_info):
                 with open("prompt_secret.txt", "r", encoding="utf-8") as f: prompt_template = f.read()
             except: prompt_template = None
         _PROMPT_CACHE = prompt_template
+    return _PROMPT_CACHE
 
-    if not _PROMPT_CACHE: return None
-    csv_data = df.to_csv(index=False)
+def _csv_tokens_estimate(df: pd.DataFrame, sample_rows: int = 20) -> int:
+    """Tokens of df.to_csv() for the log line, scaled from the last sample_rows rows (no full serialization)."""
+    if df.empty:
+        return 0
+    sample = df.tail(sample_rows)
+    header = estimate_tokens(",".join(map(str, df.columns)))
+    return header + estimate_tokens(sample.to_csv(index=False, header=False)) * len(df) // len(sample)
+
+def _prompt_parts(symbol, df, position_info, frames=None, events="") -> Optional[dict]:
+    """Per-symbol pieces of the prompt (bar data, latest bar, position block); None without a template."""
+    if not _prompt_template(): return None
+    # PROMPT_ENCODING=csv|compact|delta：{csv_data} 的序列化方式
+    mode = prompt_encoding()
+    # 超出 token 预算时较早的历史逐级聚合（时间金字塔），多周期时预算按周期均分
+    budget = _prompt_token_budget()
+    # 有事件表时，原始分辨率 K 线只保留最近 WYCKOFF_RECENT_BARS 根，事件表占用的 token 从预算中扣除
+    recent = int(os.getenv("WYCKOFF_RECENT_BARS", "240")) if events else 0
+    if events and budget:
+        budget = max(budget - estimate_tokens(events), budget // 2)
+    if frames and len(frames) > 1:
+        # 多周期：{csv_data} 内按周期分段，从小周期到大周期
+        share = budget // len(frames) if budget else 0
+        csv_data = "\n".join(f"### {p} K线\n{encode_pyramid(f, _period_minutes(p), share, mode, recent)[0]}" for p, f in frames.items())
+        period_str = "/".join(frames)
+        raw_frames = list(frames.values())
+    else:
+        period_str = next(iter(frames)) if frames else position_info.get('timeframe', '5') + "m"
+        csv_data, _ = encode_pyramid(df, _period_minutes(period_str), budget, mode, recent)
+        raw_frames = [df]
+    if events:
+        csv_data = f"### Wyckoff 事件候选\n{events}\n{csv_data}"
+    tokens = estimate_tokens(csv_data)
+    baseline = sum(_csv_tokens_estimate(f) for f in raw_frames)
+    saved = (1 - tokens / baseline) * 100 if baseline else 0.0
+    print(f"    🧮 [{symbol}] K 线数据 ≈ {tokens} tokens ({mode}, 预算 {budget or '不限'}; csv 全量 ≈ {baseline}, -{saved:.0f}%)", flush=True)
     latest = df.iloc[-1]
-    period_str = position_info.get('timeframe', '5') + "m"
-    
-    base_prompt = (_PROMPT_CACHE
-        .replace("{symbol}", symbol)
-        .replace("{latest_time}", str(latest["date"]))
-        .replace("{latest_price}", str(latest["close"]))
-        .replace("{csv_data}", csv_data)
-    )
 
     def safe_get(key):
         val = position_info.get(key)
@@ -636,90 +975,403 @@ def get_prompt_content(symbol, df, position_info):
         f"Quantity: {qty}\n"
         f"(Note: Please analyze the current trend based on this position data and timeframe.)"
     )
-    return base_prompt + position_text
+    return {
+        "symbol": symbol,
+        "latest_time": str(latest["date"]),
+        "latest_price": str(latest["close"]),
+        "csv_data": csv_data,
+        "position_text": position_text,
+    }
+
+def _render_prompt(parts: dict) -> str:
+    base_prompt = (_prompt_template()
+        .replace("{symbol}", parts["symbol"])
+        .replace("{latest_time}", parts["latest_time"])
+        .replace("{latest_price}", parts["latest_price"])
+        .replace("{csv_data}", parts["csv_data"])
+    )
+    return base_prompt + parts["position_text"]
+
+def get_prompt_content(symbol, df, position_info, frames=None, events=""):
+    parts = _prompt_parts(symbol, df, position_info, frames, events)
+    return _render_prompt(parts) if parts else None
 
 def call_openai_official(prompt: str) -> str:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key: raise ValueError("OPENAI_API_KEY missing")
     model_name = os.getenv("AI_MODEL", "gpt-4o")
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}],
-        temperature=0.2
-    )
+    client = CLIENTS.openai("openai", api_key)
+    stream = _parse_bool_env("LLM_STREAM_ENABLED", True)
+    try:
+        resp = client.chat.completions.create(
+            model=model_name,
+            messages=[{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}],
+            temperature=0.2,
+            stream=stream,
+        )
+        if stream:
+            return _stream_text("openai", _openai_chunks(resp), resp.close)
+    except Exception as e:
+        CLIENTS.report_error(str(client.base_url), e)
+        raise
     return resp.choices[0].message.content
 
+_CUSTOM_MODEL = "DeepSeek-V3.2-a"
+
 def call_custom_api(prompt: str) -> str:
     api_key = os.getenv("CUSTOM_API_KEY") 
     if not api_key: raise ValueError("CUSTOM_API_KEY missing")
     base_url = "https://api2.qiandao.mom/v1"
-    model_name = "DeepSeek-V3.2-a"
-    client = OpenAI(api_key=api_key, base_url=base_url)
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}],
-        temperature=0.2
-    )
+    model_name = _CUSTOM_MODEL
+    client = CLIENTS.openai("custom", api_key, base_url)
+    stream = _parse_bool_env("LLM_STREAM_ENABLED", True)
+    try:
+        resp = client.chat.completions.create(
+            model=model_name,
+            messages=[{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}],
+            temperature=0.2,
+            stream=stream,
+        )
+        if stream:
+            return _stream_text("custom", _openai_chunks(resp), resp.close)
+    except Exception as e:
+        CLIENTS.report_error(base_url, e)
+        raise
     return resp.choices[0].message.content
 
-def ai_analyze(symbol, df, position_info):
-    prompt = get_prompt_content(symbol, df, position_info)
-    if not prompt: return "Error: No Prompt"
-    try:
-        return call_gemini_http(prompt)
-    except Exception as e1:
-        print(f"    ⚠️ Gemini Official 失败: {str(e1)[:100]} -> 切 Custom API", flush=True)
+# 相同 prompt（K 线未变）直接复用上次的分析：键 = sha256(provider, model, prompt)，带 TTL 与容量淘汰
+_LLM_CACHE = LLMCache()
+
+def _llm_models() -> dict[str, str]:
+    return {
+        "gemini": os.getenv("GEMINI_MODEL") or "gemini-3-flash-preview",
+        "custom": _CUSTOM_MODEL,
+        "openai": os.getenv("AI_MODEL", "gpt-4o"),
+    }
+
+def _llm_failure_kind(exc: Exception) -> Optional[str]:
+    """'quota' / 'fatal' for errors that will repeat on every stock; None for transient ones."""
+    if isinstance(exc, GeminiQuotaExceeded):
+        return "quota"
+    if isinstance(exc, GeminiAuthError):
+        return "fatal"
+    # openai SDK 异常按类名识别（Custom API 与 OpenAI 共用）
+    name = type(exc).__name__
+    if name in ("AuthenticationError", "PermissionDeniedError"):
+        return "fatal"
+    if name == "RateLimitError" and "quota" in str(exc).lower():
+        return "quota"
+    return None
+
+def _breaker_open_until(provider: str, kind: str) -> float:
+    if kind == "quota":
+        # Gemini 免费配额在太平洋时间 0 点重置
+        if provider == "gemini":
+            return next_pacific_midnight()
+        return time.time() + float(os.getenv("CIRCUIT_QUOTA_COOLDOWN_MIN", "60")) * 60
+    return time.time() + float(os.getenv("CIRCUIT_FATAL_COOLDOWN_MIN", "360")) * 60
+
+def _guarded(provider: str, call):
+    """Wraps a provider call with its cross-run circuit breaker."""
+    breaker = BREAKERS.get(provider)
+
+    def run(prompt: str) -> str:
+        if not breaker.allow():
+            raise CircuitOpen(breaker.describe())
         try:
-            return call_custom_api(prompt)
-        except Exception as e2:
-            print(f"    ⚠️ Custom API 失败: {str(e2)[:100]} -> 切 OpenAI", flush=True)
+            text = call(prompt)
+        except Exception as e:
+            kind = _llm_failure_kind(e)
+            breaker.on_failure(kind, _breaker_open_until(provider, kind) if kind else None)
+            raise
+        breaker.on_success()
+        return text
+    return run
+
+def _start_provider(provider: str, call, prompt: str) -> Future:
+    """
+    Runs one provider call on a daemon thread. The future gets an `abandon()` for losing hedges:
+    a streamed response is closed (a request still waiting for headers finishes in the background,
+    never joined), and the elapsed time is recorded as a censored latency sample so slow calls
+    still count toward the percentile. Each call records exactly one latency sample.
+    """
+    fut: Future = Future()
+    t0 = time.monotonic()
+    cancel = threading.Event()
+    recorded = threading.Lock()
+
+    def record(ok: bool = True, censored: bool = False):
+        if recorded.acquire(blocking=False):
+            LLM_LATENCY.get(provider).record(time.monotonic() - t0, ok=ok, censored=censored)
+
+    def run():
+        _LLM_CALL.cancel = cancel
+        try:
+            text = call(prompt)
+        except BaseException as e:
+            if not isinstance(e, CircuitOpen):
+                record(ok=False)
+            fut.set_exception(e)
+            return
+        record(ok=bool(text))
+        fut.set_result(text)
+
+    def abandon():
+        record(censored=True)
+        cancel.set()
+
+    fut.abandon = abandon
+    threading.Thread(target=run, name=f"llm-{provider}", daemon=True).start()
+    return fut
+
+def _hedge_delay(provider: str) -> float:
+    """How long to wait on `provider` before also launching the next one: a learned latency percentile."""
+    hist = LLM_LATENCY.get(provider)
+    delay = None
+    if hist.samples >= int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "5")):
+        delay = hist.percentile(float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9")))
+    if delay is None:
+        delay = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "45"))
+    return max(float(os.getenv("LLM_HEDGE_MIN_DELAY", "5")), delay)
+
+# 流式输出中断时保留已收到的部分：下一个模型从断点续写；全部失败则返回部分内容并标记为不完整
+_INCOMPLETE_NOTE = "> ⚠️ 报告不完整"
+
+def _resumable(exc: Exception) -> str:
+    """Partial text carried by a failed streamed call, if long enough to be worth continuing."""
+    partial = getattr(exc, "partial", "") or ""
+    return partial if len(partial.strip()) >= int(os.getenv("LLM_RESUME_MIN_CHARS", "300")) else ""
+
+def _continuation_prompt(prompt: str, partial: str) -> str:
+    if not partial:
+        return prompt
+    return (f"{prompt}\n\n[PARTIAL ANSWER] A previous attempt was cut off mid-answer; its text so far is below. "
+            f"Continue exactly where it stops, in the same language and format, without repeating anything:\n\n{partial}")
+
+def _mark_incomplete(text: str, reason: str) -> str:
+    return f"{_INCOMPLETE_NOTE}：所有模型均在输出途中中断（{reason[:120]}），以下为已收到的部分。\n\n{text}"
+
+def _hedged_call(prompt: str, chain: list[tuple[str, object]]) -> tuple[str, str]:
+    """
+    Starts the primary provider; launches the next one when the current hedge delay passes
+    without an answer (or immediately when a provider fails). First non-empty response wins.
+    A provider launched after a stream broke off continues from the partial text.
+    """
+    t0 = time.monotonic()
+    running: dict[Future, tuple[str, str]] = {}  # future -> (provider, 续写前缀)
+    errors: list[str] = []
+    partial, partial_provider = "", ""
+    nxt = 0
+
+    def launch() -> float:
+        nonlocal nxt
+        provider, call = chain[nxt]
+        nxt += 1
+        running[_start_provider(provider, call, _continuation_prompt(prompt, partial))] = (provider, partial)
+        return time.monotonic() + _hedge_delay(provider)
+
+    deadline = launch()
+    while running:
+        timeout = max(0.0, deadline - time.monotonic()) if nxt < len(chain) else None
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            provider, prefix = running.pop(fut)
             try:
-                return call_openai_official(prompt)
-            except Exception as e3:
-                return f"Analysis Failed. All APIs down. Error: {e3}"
+                text = fut.result()
+            except Exception as e:
+                errors.append(f"{provider}: {str(e)[:100]}")
+                print(f"    ⚠️ {provider} 失败: {str(e)[:100]}", flush=True)
+                got = _resumable(e)
+                if got and len(prefix + got) > len(partial):
+                    partial, partial_provider = prefix + got, provider
+                continue
+            if text:
+                for loser in running:
+                    loser.abandon()
+                tail = f"，取消其余 {len(running)} 个请求" if running else ""
+                resumed = f"，续写自 {len(prefix)} 字" if prefix else ""
+                print(f"    🏁 {provider} 返回 ({time.monotonic() - t0:.1f}s){resumed}{tail}", flush=True)
+                return provider, prefix + text
+            errors.append(f"{provider}: empty response")
+        if nxt < len(chain) and (not running or time.monotonic() >= deadline):
+            if running:
+                print(f"    ⏱️ {'/'.join(p for p, _ in running.values())} 超过对冲延迟未返回，并行启动 {chain[nxt][0]}", flush=True)
+            deadline = launch()
+    if partial:
+        return partial_provider, _mark_incomplete(partial, "; ".join(errors))
+    raise Exception("; ".join(errors) or "no provider returned")
+
+def _call_llm(prompt: str) -> tuple[str, str]:
+    """
+    Runs the provider chain (hedged, or strictly sequential); returns (provider, text) or raises
+    the last error. A broken-off stream is continued by the next provider; if every provider
+    fails after some text arrived, that text comes back marked incomplete.
+    """
+    chain = [
+        ("gemini", _guarded("gemini", call_gemini_http)),
+        ("custom", _guarded("custom", call_custom_api)),
+        ("openai", _guarded("openai", call_openai_official)),
+    ]
+    if _parse_bool_env("LLM_HEDGE_ENABLED", True):
+        return _hedged_call(prompt, chain)
+
+    labels = {"gemini": "Gemini Official", "custom": "Custom API", "openai": "OpenAI"}
+    partial, partial_provider = "", ""
+    for n, (provider, call) in enumerate(chain):
+        try:
+            return provider, partial + call(_continuation_prompt(prompt, partial))
+        except Exception as e:
+            got = _resumable(e)
+            if got:
+                partial, partial_provider = partial + got, provider
+            if n + 1 == len(chain):
+                if partial:
+                    return partial_provider, _mark_incomplete(partial, str(e))
+                raise
+            print(f"    ⚠️ {labels[provider]} 失败: {str(e)[:100]} -> 切 {labels[chain[n + 1][0]]}", flush=True)
+
+def ai_analyze(symbol, df, position_info, frames=None, events="", prompt=None):
+    prompt = prompt or get_prompt_content(symbol, df, position_info, frames, events)
+    if not prompt: return "Error: No Prompt"
+
+    models = _llm_models()
+    use_cache = _parse_bool_env("LLM_CACHE_ENABLED", True)
+    if use_cache:
+        cached = _LLM_CACHE.lookup(prompt, list(models.items()))
+        if cached:
+            print(f"    💾 [{symbol}] LLM 缓存命中 ({cached[0]})，跳过 API 调用", flush=True)
+            return cached[1]
+
+    try:
+        provider, text = _call_llm(prompt)
+    except Exception as e:
+        return f"Analysis Failed. All APIs down. Error: {e}"
+    if use_cache and not text.startswith(_INCOMPLETE_NOTE):
+        _LLM_CACHE.put(prompt, provider, models[provider], text)
+    return text
+
+# 两个时间窗之间多数股票只多了几根平淡的 K 线：未触发任何阈值时沿用上次报告，省掉一次 LLM 调用
+_ANALYSIS_STATE = AnalysisState()
+
+def _position_key(ctx: dict) -> str:
+    return "|".join(str(ctx["position_info"].get(k, "")) for k in ("date", "price", "qty"))
+
+def _reused_report(ctx: dict) -> Optional[str]:
+    """The previous report (with a note) when the bars added since then are not material; None otherwise."""
+    if not _parse_bool_env("MATERIALITY_SKIP_ENABLED", True):
+        return None
+    symbol = ctx["symbol"]
+    reasons, prev = _ANALYSIS_STATE.assess(symbol, ctx["df"], ctx["period"], _position_key(ctx))
+    if not reasons:
+        print(f"    😴 [{symbol}] 自上次分析 ({prev['analyzed_at']}) 以来无显著变化，沿用上次报告", flush=True)
+        return (f"> ♻️ 自上次分析（{prev['analyzed_at']}，截至 {prev['last_date']}）以来新增 K 线未触发"
+                f"区间突破 / 放量 / 均线交叉 / 涨跌幅阈值，以下沿用上次分析结论；图表为最新数据。\n\n"
+                + prev["report"])
+    print(f"    🔎 [{symbol}] 重新分析: {', '.join(reasons)}", flush=True)
+    return None
+
+def _record_report(ctx: dict, report: str) -> str:
+    if report and not report.startswith(("Analysis Failed", "Error:", _INCOMPLETE_NOTE)):
+        _ANALYSIS_STATE.record(ctx["symbol"], ctx["df"], ctx["period"], _position_key(ctx), report)
+    return report
+
+def _ctx_prompt_parts(ctx: dict) -> Optional[dict]:
+    if "prompt_parts" not in ctx:
+        ctx["prompt_parts"] = _prompt_parts(ctx["symbol"], ctx["df"], ctx["position_info"], ctx["frames"], ctx.get("events", ""))
+    return ctx["prompt_parts"]
+
+def _llm_report(ctx: dict) -> str:
+    parts = _ctx_prompt_parts(ctx)
+    prompt = _render_prompt(parts) if parts else None
+    report = ai_analyze(ctx["symbol"], ctx["df"], ctx["position_info"], ctx["frames"], ctx.get("events", ""), prompt)
+    return _record_report(ctx, report)
+
+def _analyze(ctx: dict) -> str:
+    """LLM stage: re-analyzes only when the bars added since the last report are material."""
+    reused = _reused_report(ctx)
+    return reused if reused is not None else _llm_report(ctx)
 
 # ==========================================
-# 4. PDF 生成模块
+# 批量分析：Gemini 的瓶颈是每分钟请求数而不是 token 数，多只小窗口股票合并成一次请求
 # ==========================================
 
-def generate_pdf_report(symbol, chart_path, report_text, pdf_path):
-    html_content = markdown.markdown(report_text)
-    abs_chart_path = os.path.abspath(chart_path)
-    font_path = "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc"
-    if not os.path.exists(font_path): font_path = "msyh.ttc"
-
-    full_html = f"""
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <style>
-            @font-face {{ font-family: "MyChineseFont"; src: url("{font_path}"); }}
-            @page {{ size: A4; margin: 1cm; }}
-            body {{ font-family: "MyChineseFont", sans-serif; font-size: 12px; line-height: 1.5; }}
-            h1, h2, h3, p, div {{ font-family: "MyChineseFont", sans-serif; color: #2c3e50; }}
-            img {{ width: 18cm; margin-bottom: 20px; }}
-            .header {{ text-align: center; margin-bottom: 20px; color: #7f8c8d; font-size: 10px; }}
-        </style>
-    </head>
-    <body>
-        <div class="header">Wyckoff Quantitative Analysis | {symbol}</div>
-        <img src="{abs_chart_path}" />
-        <hr/>
-        {html_content}
-    </body>
-    </html>
+def _batch_section(parts: dict) -> str:
+    return (f"Latest bar time: {parts['latest_time']}; latest price: {parts['latest_price']}\n"
+            f"{parts['csv_data']}{parts['position_text']}")
+
+def _batch_candidate(ctx: dict) -> tuple[Optional[str], int]:
+    """
+    Called once per fetched stock in batch mode. Returns (report, 0) when no LLM call is needed
+    (materiality reuse or cache hit), (None, tokens) for a batchable stock, (None, -1) for one
+    that is too large to share a request.
     """
+    reused = _reused_report(ctx)
+    if reused is not None:
+        return reused, 0
+    parts = _ctx_prompt_parts(ctx)
+    if not parts:
+        return "Error: No Prompt", 0
+    if _parse_bool_env("LLM_CACHE_ENABLED", True):
+        cached = _LLM_CACHE.lookup(_render_prompt(parts), list(_llm_models().items()))
+        if cached:
+            print(f"    💾 [{ctx['symbol']}] LLM 缓存命中 ({cached[0]})，跳过 API 调用", flush=True)
+            return cached[1], 0
+    tokens = estimate_tokens(_batch_section(parts))
+    return None, (tokens if tokens <= int(os.getenv("LLM_BATCH_SYMBOL_MAX_TOKENS", "4000")) else -1)
+
+def _analyze_batch(ctxs: list[dict]) -> list[str]:
+    """
+    One LLM request for several stocks: the template once, one delimited data section per stock,
+    reports split back by marker lines. Each parsed report is cached under the stock's own
+    single-stock prompt; stocks whose section is missing or unparsable are retried individually.
+    """
+    if len(ctxs) == 1:
+        return [_llm_report(ctxs[0])]
+    symbols = [c["symbol"] for c in ctxs]
+    prompt = llm_batch.build_prompt(_prompt_template(), [(c["symbol"], _batch_section(_ctx_prompt_parts(c))) for c in ctxs])
+    print(f"📦 批量分析 {len(ctxs)} 只 ({', '.join(symbols)})，≈ {estimate_tokens(prompt)} tokens", flush=True)
+    reports: dict[str, str] = {}
     try:
-        with open(pdf_path, "wb") as pdf_file: pisa.CreatePDF(full_html, dest=pdf_file)
-        return True
-    except: return False
+        provider, text = _call_llm(prompt)
+        reports = llm_batch.split_reports(text, symbols)
+        models = _llm_models()
+        for c in ctxs:
+            if c["symbol"] in reports and _parse_bool_env("LLM_CACHE_ENABLED", True):
+                _LLM_CACHE.put(_render_prompt(_ctx_prompt_parts(c)), provider, models[provider], reports[c["symbol"]])
+    except Exception as e:
+        print(f"    ⚠️ 批量请求失败: {str(e)[:100]}，逐只重试", flush=True)
+
+    missing = [s for s in symbols if s not in reports]
+    if reports and missing:
+        print(f"    ⚠️ 批量结果中 {', '.join(missing)} 未能解析，逐只重试", flush=True)
+    return [_record_report(c, reports[c["symbol"]]) if c["symbol"] in reports else _llm_report(c) for c in ctxs]
 
 # ==========================================
-# 5. 主程序 (串行 + 30s 休息)
+# 4. PDF 生成模块
 # ==========================================
 
-def process_one_stock(symbol: str, position_info: dict):
+def generate_pdf_report(symbol, chart_path, report_text, pdf_path):
+    # 字体与 CSS 每个进程只准备一次（见 pdf_report.init_worker）
+    return pdf_report.build_pdf(symbol, chart_path, report_text, pdf_path)
+
+def generate_digest_report(entries: list[tuple[str, list, str]]) -> Optional[str]:
+    """PDF_DIGEST: every stock's charts + report in one PDF; returns its path."""
+    if not entries:
+        return None
+    pdf_path = f"reports/digest_{_bj_now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    t0 = time.perf_counter()
+    if not pdf_report.build_digest(entries, pdf_path):
+        return None
+    print(f"✅ 汇总报告生成完毕: {pdf_path} ({len(entries)} 只, {time.perf_counter() - t0:.1f}s, "
+          f"{os.path.getsize(pdf_path) / 1024:.0f} KB)", flush=True)
+    return pdf_path
+
+# ==========================================
+# 5. 主程序 (分阶段流水线：抓取 → 绘图/AI → PDF)
+# ==========================================
+
+def _prepare_stock(symbol: str, position_info: dict) -> Optional[dict]:
+    """抓取阶段：拉数据 + 指标，返回后续阶段所需的上下文。"""
     if position_info is None: position_info = {}
     clean_digits = ''.join(filter(str.isdigit, str(symbol)))
     clean_symbol = clean_digits.zfill(6)
@@ -735,27 +1387,214 @@ def process_one_stock(symbol: str, position_info: dict):
         print(f"    ⚠️ [{clean_symbol}] 数据为空，跳过", flush=True)
         return None
 
-    df = add_indicators(df)
+    frames = {p: add_indicators(f) for p, f in data_res["frames"].items()}
+    df = next(iter(frames.values()))
+    events = _wyckoff_events(clean_symbol, df)
     beijing_tz = timezone(timedelta(hours=8))
     ts = datetime.now(beijing_tz).strftime("%Y%m%d_%H%M%S")
 
-    chart_path = f"reports/{clean_symbol}_chart_{ts}.png"
-    pdf_path = f"reports/{clean_symbol}_report_{period}_{ts}.pdf"
+    if len(frames) > 1:
+        chart_paths = [f"reports/{clean_symbol}_chart_{p}_{ts}.png" for p in frames]
+    else:
+        chart_paths = [f"reports/{clean_symbol}_chart_{ts}.png"]
+
+    return {
+        "symbol": clean_symbol,
+        "position_info": position_info,
+        "df": df,
+        "frames": frames,
+        "period": period,
+        "chart_paths": chart_paths,
+        "pdf_path": f"reports/{clean_symbol}_report_{period}_{ts}.pdf",
+        "events": events,
+    }
 
-    generate_local_chart(clean_symbol, df, chart_path, period)
-    report_text = ai_analyze(clean_symbol, df, position_info)
+def process_one_stock(symbol: str, position_info: dict, digest: Optional[list] = None):
+    """Sequential path. With `digest` (a list) the analyzed stock is appended to it instead of getting its own PDF."""
+    ctx = _prepare_stock(symbol, position_info)
+    if ctx is None:
+        return None
+    clean_symbol = ctx["symbol"]
 
-    if generate_pdf_report(clean_symbol, chart_path, report_text, pdf_path):
+    # 绘图在进程池中与 LLM 调用并行
+    chart_job = _chart_pool().submit(charts.render_charts, clean_symbol, ctx["frames"], ctx["chart_paths"])
+    report_text = _analyze(ctx)
+    try:
+        chart_job.result()
+    except Exception as e:
+        print(f"❌ [{clean_symbol}] chart 阶段异常: {e}", flush=True)
+
+    if digest is not None:
+        digest.append((clean_symbol, ctx["chart_paths"], report_text))
+        return None
+    if generate_pdf_report(clean_symbol, ctx["chart_paths"], report_text, ctx["pdf_path"]):
         print(f"✅ [{clean_symbol}] 报告生成完毕", flush=True)
-        return pdf_path
+        return ctx["pdf_path"]
     return None
 
+def _env_workers(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+def screen_items(items: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+    """
+    Screening mode (SCREEN_ENABLED): loads SCREEN_BARS bars at SCREEN_TIMEFRAME for every symbol
+    (through the bar store, so later full runs fetch incrementally), aligns them into one
+    symbols x bars panel, scores all symbols at once and keeps the top ones. Rows with a
+    position (price/qty filled in) always pass.
+    """
+    tf_str = os.getenv("SCREEN_TIMEFRAME", "5")
+    bars = int(os.getenv("SCREEN_BARS", "300"))
+    t0 = time.perf_counter()
+
+    def load(symbol):
+        try:
+            return fetch_stock_data_dynamic(symbol, tf_str, str(bars))["df"]
+        except Exception as e:
+            print(f"    ⚠️ [{symbol}] 初筛数据获取失败: {e}", flush=True)
+            return None
+
+    with ThreadPoolExecutor(max_workers=_env_workers("FETCH_WORKERS", 2), thread_name_prefix="screen") as pool:
+        frames = dict(zip([s for s, _ in items], pool.map(load, [s for s, _ in items])))
+    t1 = time.perf_counter()
+    panel = build_panel(frames, bars)
+    scores = score_panel(panel)
+    picked = set(select_symbols(scores))
+    t2 = time.perf_counter()
+
+    held = {s for s, info in items if str((info or {}).get("price", "")).strip() or str((info or {}).get("qty", "")).strip()}
+    print(f"🔎 初筛 {len(panel.symbols)}/{len(items)} 只 ({panel.close.shape[1]} 根 {tf_str}m, "
+          f"面板 {panel.nbytes / 1e6:.1f} MB): 抓取 {t1 - t0:.1f}s, 打分 {(t2 - t1) * 1000:.0f} ms; "
+          f"入选 {len(picked)} 只 + 持仓 {len(held - picked)} 只", flush=True)
+    for row in scores[scores["symbol"].isin(picked)].itertuples():
+        print(f"    🔎 {row.symbol}: {row.score:.2f} ({row.reasons or '量能'})", flush=True)
+    return [(s, info) for s, info in items if s in picked or s in held]
+
+def run_pipeline(items: list[tuple[str, dict]]) -> list[str]:
+    """
+    Staged pipeline with bounded concurrency per stage:
+      fetch (threads, per-source limits inside) -> chart (CHART_WORKERS processes) + LLM (threads) -> PDF (process pool).
+    Stock N+1's fetch overlaps stock N's LLM call. Returns PDF paths in watchlist order.
+    CPU workers are spawned (not forked) so they never inherit locks held by fetch threads.
+    With LLM_BATCH_ENABLED, small stocks are buffered and sent to the LLM several per request.
+    With PDF_DIGEST, finished stocks are collected and written into one digest PDF at the end.
+    """
+    fetch_workers = _env_workers("FETCH_WORKERS", 2)
+    llm_workers = _env_workers("LLM_WORKERS", 2)
+    cpu_workers = _env_workers("RENDER_WORKERS", min(2, os.cpu_count() or 1))
+    chart_pool = _chart_pool()
+    batch_on = _parse_bool_env("LLM_BATCH_ENABLED", False)
+    batch_budget = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "24000"))
+    batch_max = _env_workers("LLM_BATCH_MAX_SYMBOLS", 4)
+    digest = _parse_bool_env("PDF_DIGEST", False)
+    digest_entries: dict[int, tuple] = {}
+
+    results: dict[int, str] = {}
+    pending: dict = {}  # future -> (stage, index, ctx)；批量阶段 index/ctx 为列表
+    waiting: dict[int, dict] = {}  # index -> {"ctx", "chart_done", "report_text"}
+    batch_buf: list[tuple[int, int]] = []  # (index, tokens)，等待合并成批量请求
+
+    with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="fetch") as fetch_pool, \
+         ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="llm") as llm_pool, \
+         ProcessPoolExecutor(max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=pdf_report.init_worker) as cpu_pool:
+
+        def deliver(i: int, stage: str, out) -> None:
+            slot = waiting.get(i)
+            if slot is None:
+                return
+            if stage == "chart":
+                slot["chart_done"] = True
+            else:
+                slot["report_text"] = out
+            if slot["chart_done"] and slot["report_text"] is not None:
+                ctx = waiting.pop(i)["ctx"]
+                if digest:
+                    digest_entries[i] = (ctx["symbol"], ctx["chart_paths"], slot["report_text"])
+                    return
+                pending[cpu_pool.submit(pdf_report.build_pdf, ctx["symbol"], ctx["chart_paths"], slot["report_text"], ctx["pdf_path"])] = ("pdf", i, ctx)
+
+        def flush_batches() -> None:
+            for group in llm_batch.pack(batch_buf, batch_budget, batch_max):
+                ctxs = [waiting[i]["ctx"] for i in group]
+                pending[llm_pool.submit(_analyze_batch, ctxs)] = ("batch", group, ctxs)
+            batch_buf.clear()
+
+        for i, (symbol, info) in enumerate(items):
+            pending[fetch_pool.submit(_prepare_stock, symbol, info)] = ("fetch", i, symbol)
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, i, payload = pending.pop(fut)
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    if stage == "batch":
+                        print(f"❌ 批量分析异常: {e}，逐只重试", flush=True)
+                        for j, ctx in zip(i, payload):
+                            pending[llm_pool.submit(_llm_report, ctx)] = ("llm", j, ctx)
+                        continue
+                    if stage == "candidate":
+                        print(f"❌ [{payload['symbol']}] 批量预处理异常: {e}，改为单独请求", flush=True)
+                        pending[llm_pool.submit(_llm_report, payload)] = ("llm", i, payload)
+                        continue
+                    sym = payload if stage == "fetch" else payload["symbol"]
+                    print(f"❌ [{sym}] {stage} 阶段异常: {e}", flush=True)
+                    if stage == "chart":
+                        out = None  # 图表失败不阻断报告
+                    else:
+                        waiting.pop(i, None)
+                        continue
+
+                if stage == "fetch":
+                    ctx = out
+                    if ctx is None:
+                        continue
+                    waiting[i] = {"ctx": ctx, "chart_done": False, "report_text": None}
+                    pending[chart_pool.submit(charts.render_charts, ctx["symbol"], ctx["frames"], ctx["chart_paths"])] = ("chart", i, ctx)
+                    # 批量模式下的复用判断 / prompt 构建 / 缓存查询同样放在 LLM 线程池，异常只影响该股票
+                    task = _batch_candidate if batch_on else _analyze
+                    pending[llm_pool.submit(task, ctx)] = ("candidate" if batch_on else "llm", i, ctx)
+                elif stage == "candidate":
+                    report, tokens = out
+                    ctx = payload
+                    if report is not None:
+                        deliver(i, "llm", report)
+                    elif tokens < 0:
+                        pending[llm_pool.submit(_llm_report, ctx)] = ("llm", i, ctx)
+                    else:
+                        batch_buf.append((i, tokens))
+                        if len(batch_buf) >= batch_max or sum(t for _, t in batch_buf) >= batch_budget:
+                            flush_batches()
+                elif stage == "pdf":
+                    if out:
+                        print(f"✅ [{payload['symbol']}] 报告生成完毕", flush=True)
+                        results[i] = payload["pdf_path"]
+                elif stage == "batch":
+                    for j, text in zip(i, out):
+                        deliver(j, "llm", text)
+                else:
+                    deliver(i, stage, out)
+
+            # 抓取与批量预处理全部结束后，剩余不足一批的也发出去
+            if batch_buf and not any(st in ("fetch", "candidate") for st, _, _ in pending.values()):
+                flush_batches()
+
+    if digest:
+        path = generate_digest_report([digest_entries[i] for i in sorted(digest_entries)])
+        return [path] if path else []
+    return [results[i] for i in sorted(results)]
+
 def main():
     os.makedirs("data", exist_ok=True)
     os.makedirs("reports", exist_ok=True)
     active_slot = _schedule_gate()
     if not active_slot:
         return
+    _load_heavy_modules()
     print("☁️ 正在连接 Google Sheets...", flush=True)
     try:
         sm = SheetManager()
@@ -765,34 +1604,78 @@ def main():
         print(f"❌ Sheet 连接失败: {e}", flush=True)
         return
 
-    generated_pdfs = []
+    run_state = _load_run_state()
+    RATE_LIMITS.load_state(run_state.get("rate_control", {}))
+    LLM_LATENCY.load_state(run_state.get("llm_latency", {}))
+    STREAM_STATS.load_state(run_state.get("llm_stream", {}))
+    BREAKERS.load_state(run_state.get("circuit", {}))
+    CLIENTS.load_state(run_state.get("http_close_hosts", {}))
     items = list(stocks_dict.items())
-    for i, (symbol, info) in enumerate(items):
-        try:
-            pdf_path = process_one_stock(symbol, info)
-            if pdf_path: generated_pdfs.append(pdf_path)
-        except Exception as e:
-            print(f"❌ [{symbol}] 处理发生异常: {e}", flush=True)
-
-        if i < len(items) - 1:
-            print("⏳ 强制冷却 30秒...", flush=True)
-            time.sleep(30)
+    try:
+        _start_fresh_tail_stage(items)
+        # 先初筛再预取：只为入选的股票排队完整窗口的 BaoStock 查询
+        if _parse_bool_env("SCREEN_ENABLED", False):
+            items = screen_items(items)
+        _prefetch_baostock(items)
+        if _parse_bool_env("PIPELINE_ENABLED", True):
+            generated_pdfs = run_pipeline(items)
+        else:
+            generated_pdfs = []
+            digest = [] if _parse_bool_env("PDF_DIGEST", False) else None
+            for symbol, info in items:
+                try:
+                    pdf_path = process_one_stock(symbol, info, digest)
+                    if pdf_path: generated_pdfs.append(pdf_path)
+                except Exception as e:
+                    print(f"❌ [{symbol}] 处理发生异常: {e}", flush=True)
+            if digest:
+                digest_path = generate_digest_report(digest)
+                if digest_path: generated_pdfs.append(digest_path)
+    finally:
+        _shutdown_chart_pool()
+        _BS_SESSION.logout()
+        _VOLUME_UNITS.save()
+        _ANALYSIS_STATE.save()
 
     if generated_pdfs:
         with open("push_list.txt", "w", encoding="utf-8") as f:
             for pdf in generated_pdfs: f.write(f"{pdf}\n")
     else:
         print("\n⚠️ 无报告生成", flush=True)
+    print(f"📊 {_LLM_CACHE.summary()}", flush=True)
+    print(f"📡 流式统计: {STREAM_STATS.summary()}", flush=True)
 
-    # 记录本次时间窗已执行（用于高频 schedule 去重）
+    # 记录本次时间窗已执行（用于高频 schedule 去重）+ 各数据源学到的速率
+    state = _load_run_state()
+    state["rate_control"] = RATE_LIMITS.snapshot()
+    state["llm_latency"] = LLM_LATENCY.snapshot()
+    state["llm_stream"] = STREAM_STATS.snapshot()
+    state["circuit"] = BREAKERS.snapshot()
+    state["http_close_hosts"] = CLIENTS.snapshot()
     if active_slot and active_slot != "manual":
-        state = _load_run_state()
         day_key = _bj_now().strftime("%Y-%m-%d")
         state.setdefault(day_key, {})
         state[day_key][active_slot] = _bj_now().isoformat()
-        _save_run_state(state)
+    _save_run_state(state)
+
+def gate_only() -> int:
+    """
+    `python main.py --gate-only`: stdlib-only pre-check for CI. Prints the decision and writes
+    active=true|false (+ slot) to $GITHUB_OUTPUT so the workflow can skip installing dependencies.
+    """
+    active_slot = _schedule_gate()
+    out = os.getenv("GITHUB_OUTPUT")
+    if out:
+        with open(out, "a", encoding="utf-8") as f:
+            f.write(f"active={'true' if active_slot else 'false'}\n")
+            f.write(f"slot={active_slot or ''}\n")
+    if active_slot:
+        print(f"✅ 命中时间窗: {active_slot}", flush=True)
+    return 0
 
 if __name__ == "__main__":
+    if "--gate-only" in sys.argv[1:]:
+        sys.exit(gate_only())
     main()
 
 
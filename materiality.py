@@ -0,0 +1,129 @@
+import json
+import math
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+
+def _f(v) -> Optional[float]:
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(v) else v
+
+
+def _ma_side(row) -> int:
+    """+1 if MA50 is above MA200, -1 if below, 0 if either is missing."""
+    ma50, ma200 = _f(row.get("ma50")), _f(row.get("ma200"))
+    if ma50 is None or ma200 is None:
+        return 0
+    return 1 if ma50 > ma200 else -1
+
+
+class AnalysisState:
+    """
+    Remembers what each symbol's last report was based on (data/analysis_state.json) and decides
+    whether the bars added since then are material enough to pay for another LLM call:
+    range breakout, volume z-score spike, MA50/MA200 cross, or % move since the last analysis.
+    """
+
+    def __init__(self, path: str = os.path.join("data", "analysis_state.json")):
+        self.path = path
+        self.range_bars = int(os.getenv("MATERIAL_RANGE_BARS", "120"))
+        self.vol_z = float(os.getenv("MATERIAL_VOL_Z", "3"))
+        self.move_pct = float(os.getenv("MATERIAL_MOVE_PCT", "1.5"))
+        self.max_age_h = float(os.getenv("MATERIAL_MAX_AGE_HOURS", "24"))
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._table: dict = {}
+        try:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self._table = json.load(f) or {}
+        except Exception:
+            self._table = {}
+
+    def _snapshot(self, df, period: str, position_key: str) -> dict:
+        win = df.tail(self.range_bars)
+        vol = win["volume"].astype(float)
+        last = df.iloc[-1]
+        return {
+            "period": period,
+            "position": position_key,
+            "last_date": str(last["date"]),
+            "close": _f(last["close"]),
+            "range_high": _f(win["high"].max()),
+            "range_low": _f(win["low"].min()),
+            "vol_mean": _f(vol.mean()),
+            "vol_std": _f(vol.std()),
+            "ma_side": _ma_side(last),
+        }
+
+    def assess(self, symbol: str, df, period: str, position_key: str) -> tuple[list[str], Optional[dict]]:
+        """
+        Returns (reasons, previous entry). An empty reason list means nothing material happened
+        and the previous report (entry['report']) can be reused.
+        """
+        with self._lock:
+            prev = self._table.get(symbol)
+        if not prev or not prev.get("report"):
+            return ["首次分析"], None
+        if prev.get("period") != period or prev.get("position") != position_key:
+            return ["周期或持仓配置变化"], prev
+        try:
+            age_h = (datetime.now() - datetime.fromisoformat(prev["analyzed_at"])).total_seconds() / 3600
+        except (KeyError, ValueError):
+            age_h = float("inf")
+        if age_h > self.max_age_h:
+            return [f"上次分析已过 {age_h:.0f} 小时"], prev
+
+        dates = df["date"].astype(str)
+        new = df[dates > prev["last_date"]]
+        if new.empty:
+            return [], prev
+
+        reasons = []
+        hi, lo = prev.get("range_high"), prev.get("range_low")
+        if hi is not None and float(new["high"].max()) > hi:
+            reasons.append(f"突破区间上沿 {hi:g}")
+        if lo is not None and float(new["low"].min()) < lo:
+            reasons.append(f"跌破区间下沿 {lo:g}")
+
+        mean, std = prev.get("vol_mean"), prev.get("vol_std")
+        if mean is not None and std:
+            z = (float(new["volume"].max()) - mean) / std
+            if z >= self.vol_z:
+                reasons.append(f"成交量异动 z={z:.1f}")
+
+        side = _ma_side(df.iloc[-1])
+        if side and prev.get("ma_side") and side != prev["ma_side"]:
+            reasons.append("MA50/MA200 交叉")
+
+        c0, c1 = prev.get("close"), _f(df.iloc[-1]["close"])
+        if c0 and c1 is not None:
+            move = (c1 / c0 - 1) * 100
+            if abs(move) >= self.move_pct:
+                reasons.append(f"较上次分析 {move:+.2f}%")
+        return reasons, prev
+
+    def record(self, symbol: str, df, period: str, position_key: str, report: str) -> None:
+        entry = self._snapshot(df, period, position_key)
+        entry["analyzed_at"] = datetime.now().isoformat(timespec="seconds")
+        entry["report"] = report
+        with self._lock:
+            self._table[symbol] = entry
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(self._table, f, ensure_ascii=False, indent=2)
+                self._dirty = False
+            except Exception as e:
+                print(f"    ⚠️ 分析状态写入失败: {e}", flush=True)
@@ -0,0 +1,115 @@
+import html
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+# PDF 生成：中文字体在每个进程里只通过 reportlab 注册一次（按用到的字形子集嵌入），CSS 只生成一次；
+# 注册失败时退回逐份文档的 @font-face
+FONT_NAME = "MyChineseFont"
+_FONT_CANDIDATES = ("/usr/share/fonts/truetype/wqy/wqy-microhei.ttc", "msyh.ttc")
+
+_markdown = None
+_pisa = None
+_css = None
+
+_BASE_CSS = """
+    @page {{ size: A4; margin: 1cm; }}
+    body {{ font-family: "{font}", sans-serif; font-size: 12px; line-height: 1.5; }}
+    h1, h2, h3, p, div {{ font-family: "{font}", sans-serif; color: #2c3e50; }}
+    img {{ width: 18cm; margin-bottom: 20px; }}
+    .header {{ text-align: center; margin-bottom: 20px; color: #7f8c8d; font-size: 10px; }}
+    .toc {{ font-size: 13px; }}
+"""
+
+
+def _font_path() -> Optional[str]:
+    return next((p for p in _FONT_CANDIDATES if os.path.exists(p)), None)
+
+
+def _register_font(path: str) -> bool:
+    """Registers the TTC with reportlab under FONT_NAME (all four styles) and maps the CSS name in xhtml2pdf."""
+    try:
+        import xhtml2pdf.default
+        from reportlab.lib.fonts import addMapping
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        pdfmetrics.registerFont(TTFont(FONT_NAME, path, subfontIndex=0))
+        for bold in (0, 1):
+            for italic in (0, 1):
+                addMapping(FONT_NAME, bold, italic, FONT_NAME)
+        xhtml2pdf.default.DEFAULT_FONT[FONT_NAME.lower()] = FONT_NAME
+        return True
+    except Exception as e:
+        print(f"    ⚠️ 中文字体注册失败，改用 @font-face: {e}", flush=True)
+        return False
+
+
+def init_worker() -> None:
+    """Process-pool initializer (idempotent): markdown / xhtml2pdf imports, font registration and CSS, once per process."""
+    global _markdown, _pisa, _css
+    if _pisa is not None:
+        return
+    import markdown
+    from xhtml2pdf import pisa
+    path = _font_path()
+    css = _BASE_CSS.format(font=FONT_NAME)
+    if path and not _register_font(path):
+        css = f'@font-face {{ font-family: "{FONT_NAME}"; src: url("{path}"); }}\n' + css
+    _markdown, _pisa, _css = markdown, pisa, css
+
+
+def _stock_section(symbol: str, chart_paths, report_text: str) -> str:
+    chart_paths = [chart_paths] if isinstance(chart_paths, str) else list(chart_paths)
+    img_tags = "\n".join(f'<img src="{os.path.abspath(p)}" />' for p in chart_paths if os.path.exists(p))
+    return f"""
+        <div class="header">Wyckoff Quantitative Analysis | {html.escape(symbol)}</div>
+        {img_tags}
+        <hr/>
+        {_markdown.markdown(report_text or "")}
+    """
+
+
+def _write(full_html: str, pdf_path: str, label: str) -> bool:
+    try:
+        with open(pdf_path, "wb") as pdf_file:
+            result = _pisa.CreatePDF(full_html, dest=pdf_file, encoding="utf-8")
+    except Exception as e:
+        print(f"❌ [{label}] PDF 生成失败: {e}", flush=True)
+        return False
+    if result.err:
+        # xhtml2pdf 对缺图等问题也计错误，文件仍可用：只记录，不丢弃
+        print(f"    ⚠️ [{label}] xhtml2pdf 报告 {result.err} 个错误", flush=True)
+    return os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 0
+
+
+def _document(body: str) -> str:
+    return f"""
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <style>{_css}</style>
+    </head>
+    <body>
+    {body}
+    </body>
+    </html>
+    """
+
+
+def build_pdf(symbol: str, chart_paths, report_text: str, pdf_path: str) -> bool:
+    """One stock's report: charts, then the analysis rendered from markdown."""
+    init_worker()
+    return _write(_document(_stock_section(symbol, chart_paths, report_text)), pdf_path, symbol)
+
+
+def build_digest(entries: list[tuple[str, list, str]], pdf_path: str) -> bool:
+    """All stocks in one PDF (shared embedded font): a contents page, then one section per stock on a new page."""
+    if not entries:
+        return False
+    init_worker()
+    now = datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M")
+    toc = "".join(f"<li>{html.escape(symbol)}</li>" for symbol, _, _ in entries)
+    body = [f'<h1>Wyckoff 汇总报告 ({now} 北京时间)</h1><div class="toc"><p>共 {len(entries)} 只：</p><ol>{toc}</ol></div>']
+    for symbol, chart_paths, report_text in entries:
+        body.append('<pdf:nextpage />' + _stock_section(symbol, chart_paths, report_text))
+    return _write(_document("\n".join(body)), pdf_path, "digest")
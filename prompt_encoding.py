@@ -0,0 +1,189 @@
+import math
+import os
+
+from trade_calendar import SESSION_MINUTES, session_minutes
+
+# csv: 原样 df.to_csv；compact: 日期分组 + 根序号 + 按最小价位取整 + 成交量(手)；delta: 在 compact 基础上价格用价位差表示
+ENCODINGS = ("csv", "compact", "delta")
+
+
+def prompt_encoding() -> str:
+    mode = (os.getenv("PROMPT_ENCODING") or "csv").strip().lower()
+    return mode if mode in ENCODINGS else "csv"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough tokenizer-free estimate: ~1 token per 3.5 ASCII chars (digit runs split into short
+    chunks) and ~1 token per CJK/other char. Good enough to compare encodings per stock.
+    """
+    ascii_n = sum(1 for ch in text if ord(ch) < 128)
+    return int(math.ceil(ascii_n / 3.5 + (len(text) - ascii_n)))
+
+
+def _price_decimals(df) -> int:
+    """2 for ordinary A-shares (tick 0.01); 3 when prices use a finer tick (ETFs / funds)."""
+    import numpy as np
+    px = df[["open", "high", "low", "close"]].to_numpy(dtype=np.float64).ravel()
+    px = px[np.isfinite(px)]
+    if len(px) == 0:
+        return 2
+    return 2 if np.allclose(px * 100, np.round(px * 100), atol=1e-6) else 3
+
+
+def _fmt(values, decimals: int) -> list[str]:
+    """Fixed-decimal strings; NaN -> '' so undefined MAs cost one comma."""
+    import numpy as np
+    out = np.char.mod(f"%.{decimals}f", np.nan_to_num(values))
+    out[~np.isfinite(values)] = ""
+    return out.tolist()
+
+
+def encode_bars(df, tf_min: int, mode: str = "compact") -> str:
+    """
+    Serializes an OHLCV(+MA) frame for the {csv_data} placeholder.
+    compact: one '@YYYY-MM-DD' line per trading day, then rows keyed by k = bar number within the
+    session (bar end = 09:30 + k*tf trading minutes, lunch break skipped), prices rounded to the tick,
+    volume in lots, MA columns only when defined. delta: prices as tick offsets (see legend line).
+    """
+    if mode == "csv" or df.empty:
+        return df.to_csv(index=False)
+    if tf_min >= SESSION_MINUTES:
+        return _encode_daily(df, mode)
+
+    import numpy as np
+    dates = df["date"].to_numpy(dtype="datetime64[ns]")
+    days = dates.astype("datetime64[D]")
+    k = session_minutes(dates) // tf_min
+    dec = _price_decimals(df)
+    tick = 10.0 ** -dec
+
+    o, h, l, c = (df[x].to_numpy(dtype=np.float64) for x in ("open", "high", "low", "close"))
+    lots = np.round(df["volume"].to_numpy(dtype=np.float64) / 100.0)
+    ma_cols = [m for m in ("ma50", "ma200") if m in df.columns and df[m].notna().any()]
+
+    cols = {"k": k.astype(str).tolist()}
+    if mode == "delta":
+        # 整数价位：c 为相对上一根收盘的变化，o/h/l 为相对本根收盘的偏移
+        ci = np.round(c / tick).astype(np.int64)
+        base = int(ci[0])
+        cols["dc"] = np.diff(ci, prepend=base).astype(str).tolist()
+        for name, arr in (("o", o), ("h", h), ("l", l)):
+            cols[name] = (np.round(arr / tick).astype(np.int64) - ci).astype(str).tolist()
+        legend = (f"# {tf_min}m bars, delta encoding in ticks of {tick:g}: close[0]={base * tick:.{dec}f}, "
+                  f"dc=close change vs previous bar, o/h/l=offset from this bar's close; "
+                  f"v=volume in lots (100 shares); MAs in price units.")
+    else:
+        for name, arr in (("o", o), ("h", h), ("l", l), ("c", c)):
+            cols[name] = _fmt(arr, dec)
+        legend = f"# {tf_min}m bars, prices rounded to tick {tick:g}; v=volume in lots (100 shares)."
+    cols["v"] = lots.astype(np.int64).astype(str).tolist()
+    for m in ma_cols:
+        cols[m] = _fmt(df[m].to_numpy(dtype=np.float64), dec)
+
+    legend += (f" Each '@date' line starts a trading day; k = bar number in that session "
+               f"(bar end = 09:30 + k*{tf_min} trading minutes, 11:30-13:00 lunch skipped).")
+    header = ",".join(cols)
+    columns = list(cols.values())
+    lines = [legend, header]
+    day_starts = set(np.flatnonzero(np.r_[True, days[1:] != days[:-1]]).tolist())
+    for i in range(len(df)):
+        if i in day_starts:
+            lines.append(f"@{str(days[i])}")
+        lines.append(",".join(col[i] for col in columns))
+    return "\n".join(lines) + "\n"
+
+
+def _encode_daily(df, mode: str) -> str:
+    import numpy as np
+    dec = _price_decimals(df)
+    days = df["date"].to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype(str).tolist()
+    cols = [days] + [_fmt(df[x].to_numpy(dtype=np.float64), dec) for x in ("open", "high", "low", "close")]
+    cols.append(np.round(df["volume"].to_numpy(dtype=np.float64) / 100.0).astype(np.int64).astype(str).tolist())
+    lines = ["# daily bars; v=volume in lots (100 shares).", "d,o,h,l,c,v"]
+    lines += [",".join(row) for row in zip(*cols)]
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================
+# 时间金字塔：最近的 K 线保留原始分辨率，越早的历史聚合得越粗（如 5m -> 30m -> 日线）
+# ==========================================
+
+def _coarser_levels(tf_min: int) -> list[int]:
+    mid = next((t for t in (30, 60) if t > tf_min and t % tf_min == 0), None)
+    return [t for t in (mid, SESSION_MINUTES) if t and t > tf_min]
+
+
+def _aggregate(df, src_tf: int, dst_tf: int):
+    from resample import resample_bars, resample_daily
+    df = df[["date", "open", "high", "low", "close", "volume"]]
+    if dst_tf >= SESSION_MINUTES:
+        return resample_daily(df)
+    return resample_bars(df, src_tf, dst_tf, keep_partial=True)
+
+
+def _boundary_index(df, cut: int, dst_tf: int) -> int:
+    """Smallest i >= cut such that rows [:i] end exactly on a dst_tf bucket (or trading-day) boundary."""
+    import numpy as np
+    if cut <= 0:
+        return 0
+    dates = df["date"].to_numpy(dtype="datetime64[ns]")
+    if dst_tf >= SESSION_MINUTES:
+        days = dates.astype("datetime64[D]")
+        is_end = np.r_[days[1:] != days[:-1], True]
+    else:
+        is_end = session_minutes(dates) % dst_tf == 0
+    hits = np.flatnonzero(is_end[cut - 1:])
+    return cut + int(hits[0]) if len(hits) else len(df)
+
+
+def _level_name(tf_min: int) -> str:
+    return "daily" if tf_min >= SESSION_MINUTES else f"{tf_min}m"
+
+
+def encode_pyramid(df, tf_min: int, budget_tokens: int, mode: str = "compact", max_full_rows: int = 0) -> tuple[str, int]:
+    """
+    Encodes df within ~budget_tokens (<= 0: unlimited). If the full-resolution encoding fits it is returned as-is;
+    otherwise the budget is split across levels (PROMPT_PYRAMID_SHARES, newest first) and each
+    older slice is aggregated to the next coarser timeframe with OHLCV semantics.
+    max_full_rows (> 0) additionally caps the full-resolution slice even when everything would fit.
+    MAs stay on the full-resolution slice only. Returns (text, estimated tokens).
+    """
+    text = encode_bars(df, tf_min, mode)
+    tokens = estimate_tokens(text)
+    levels = [tf_min] + _coarser_levels(tf_min)
+    capped = 0 < max_full_rows < len(df)
+    fits = budget_tokens <= 0 or tokens <= budget_tokens
+    if (fits and not capped) or len(levels) == 1 or len(df) < 2:
+        return text, tokens
+    if budget_tokens <= 0:
+        budget_tokens = tokens
+
+    shares = [float(x) for x in (os.getenv("PROMPT_PYRAMID_SHARES") or "0.5,0.3,0.2").split(",") if x.strip()]
+    shares = (shares + [shares[-1]] * len(levels))[:len(levels)]
+    total = sum(shares)
+    per_row = tokens / len(df)
+
+    segments = []  # (tf, frame)，从新到旧
+    rest, src_tf = df, tf_min
+    for i, lvl in enumerate(levels):
+        rows = max(1, int(budget_tokens * shares[i] / total / per_row))
+        if i == 0 and capped:
+            rows = min(rows, max_full_rows)
+        if i == len(levels) - 1 or len(rest) <= rows:
+            segments.append((lvl, rest.tail(rows)))
+            break
+        cut = _boundary_index(rest, len(rest) - rows, levels[i + 1])
+        segments.append((lvl, rest.iloc[cut:]))
+        if cut == 0:
+            break
+        rest, src_tf = _aggregate(rest.iloc[:cut], src_tf, levels[i + 1]), levels[i + 1]
+
+    parts = []
+    for lvl, seg in reversed(segments):
+        if seg.empty:
+            continue
+        label = "full resolution, most recent" if lvl == tf_min else "aggregated older history"
+        parts.append(f"[{_level_name(lvl)} | {len(seg)} bars | {label}]\n{encode_bars(seg, lvl, mode)}")
+    text = "\n".join(parts)
+    return text, estimate_tokens(text)
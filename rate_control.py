@@ -0,0 +1,112 @@
+import re
+import threading
+import time
+from typing import Optional
+
+# 被服务端掐断连接时的典型报错（Eastmoney 限流基本都表现为这几种）
+_THROTTLE_MARKERS = (
+    "RemoteDisconnected",
+    "Connection aborted",
+    "ConnectionResetError",
+    "Connection reset by peer",
+    "Too Many Requests",
+)
+# 只认 HTTP 状态码 429，不匹配股票代码、时间戳等里恰好出现的 "429"
+_STATUS_429 = re.compile(r"\b(?:HTTP|status(?:_code)?|code)\s*[:=]?\s*429\b|\b429 Client Error\b", re.I)
+
+def is_throttle_error(exc: BaseException) -> bool:
+    if isinstance(exc, (ConnectionResetError, ConnectionAbortedError)):
+        return True
+    status = getattr(getattr(exc, "response", None), "status_code", None) or getattr(exc, "status_code", None)
+    if status == 429:
+        return True
+    text = f"{type(exc).__name__}: {exc}"
+    return any(m in text for m in _THROTTLE_MARKERS) or bool(_STATUS_429.search(text))
+
+
+class RateController:
+    """
+    AIMD pacing for a single data source.
+    Rate is requests/second: +increase after each success, *decrease on throttling.
+    acquire() reserves the next send slot, so concurrent callers are spaced 1/rate apart.
+    """
+
+    def __init__(self, name: str, rate: float, min_rate: float, max_rate: float,
+                 increase: float = 0.1, decrease: float = 0.5):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = min(max(rate, min_rate), max_rate)
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Blocks until this caller's slot; returns seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        wait_s = slot - now
+        if wait_s > 0:
+            time.sleep(wait_s)
+        return wait_s
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # 立即把下一个发送时间推后，让已在排队的调用也一起退避
+            self._next_slot = max(self._next_slot, time.monotonic()) + 1.0 / self.rate
+        print(f"    🐢 [{self.name}] 触发限流，速率降至 {self.rate:.2f} req/s", flush=True)
+
+    def snapshot(self) -> dict:
+        return {"rate": round(self.rate, 4), "updated": int(time.time())}
+
+
+class RateRegistry:
+    """Shared controllers keyed by source name; learned rates round-trip through run_state.json."""
+
+    def __init__(self):
+        self._controllers: dict[str, RateController] = {}
+        self._saved: dict = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, rate: float, min_rate: float, max_rate: float,
+                 increase: float = 0.1, decrease: float = 0.5) -> RateController:
+        with self._lock:
+            if name not in self._controllers:
+                self._controllers[name] = RateController(name, rate, min_rate, max_rate, increase, decrease)
+                self._restore(self._controllers[name])
+            return self._controllers[name]
+
+    def get(self, name: str) -> Optional[RateController]:
+        return self._controllers.get(name)
+
+    def load_state(self, saved: dict) -> None:
+        with self._lock:
+            self._saved = dict(saved or {})
+            for ctl in self._controllers.values():
+                self._restore(ctl)
+
+    def _restore(self, ctl: RateController) -> None:
+        entry = self._saved.get(ctl.name) or {}
+        try:
+            rate = float(entry.get("rate", 0))
+        except (TypeError, ValueError):
+            return
+        if rate > 0:
+            ctl.rate = min(max(rate, ctl.min_rate), ctl.max_rate)
+
+    def snapshot(self) -> dict:
+        out = dict(self._saved)
+        for name, ctl in self._controllers.items():
+            out[name] = ctl.snapshot()
+        return out
+
+
+RATE_LIMITS = RateRegistry()
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from trade_calendar import AM_MINUTES, session_clock, session_minutes
+
+SUPPORTED_TIMEFRAMES = (1, 5, 15, 30, 60)
+
+
+def resample_bars(df: pd.DataFrame, src_tf: int, dst_tf: int, keep_partial: bool = False) -> pd.DataFrame:
+    """
+    Aggregates bar-end-labelled OHLCV from src_tf to dst_tf minutes without crossing the lunch
+    break or the day boundary (first open, max high, min low, last close, summed volume).
+    AkShare's 1m 09:30 auction bar is folded into the first bucket of the morning.
+    The trailing bucket is dropped unless it is complete (or keep_partial=True).
+    """
+    if dst_tf == src_tf or df.empty:
+        return df.copy()
+    if dst_tf % src_tf != 0 or AM_MINUTES % dst_tf != 0:
+        raise ValueError(f"cannot resample {src_tf}m -> {dst_tf}m")
+
+    df = df.sort_values("date")
+    dates = df["date"].to_numpy(dtype="datetime64[ns]")
+    mins = session_minutes(dates)
+    on_session = mins >= 0
+    if not on_session.all():
+        df, dates, mins = df[on_session], dates[on_session], mins[on_session]
+    if len(df) == 0:
+        return df.iloc[0:0].copy()
+
+    bucket = np.maximum(1, -(-mins // dst_tf))  # ceil，09:30 (0) 归入第一根
+    days = dates.astype("datetime64[D]")
+    key = days.astype(np.int64) * 1000 + bucket
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))
+    ends = np.concatenate((starts[1:], [len(key)])) - 1
+
+    o = df["open"].to_numpy(dtype=np.float64)
+    h = df["high"].to_numpy(dtype=np.float64)
+    lo = df["low"].to_numpy(dtype=np.float64)
+    c = df["close"].to_numpy(dtype=np.float64)
+    v = df["volume"].to_numpy(dtype=np.float64)
+
+    out = pd.DataFrame({
+        "date": session_clock(days[starts], bucket[starts] * dst_tf),
+        "open": o[starts],
+        "high": np.fmax.reduceat(h, starts),
+        "low": np.fmin.reduceat(lo, starts),
+        "close": c[ends],
+        "volume": np.add.reduceat(np.nan_to_num(v), starts),
+    })
+    if not keep_partial and mins[ends[-1]] < bucket[starts[-1]] * dst_tf:
+        out = out.iloc[:-1]
+    return out.reset_index(drop=True)
+
+
+def resample_daily(df: pd.DataFrame) -> pd.DataFrame:
+    """Intraday bars -> one OHLCV bar per trading day, labelled with the day's date (00:00)."""
+    if df.empty:
+        return df.copy()
+    df = df.sort_values("date")
+    days = df["date"].to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    starts = np.concatenate(([0], np.flatnonzero(days[1:] != days[:-1]) + 1))
+    ends = np.concatenate((starts[1:], [len(days)])) - 1
+    return pd.DataFrame({
+        "date": days[starts].astype("datetime64[ns]"),
+        "open": df["open"].to_numpy(dtype=np.float64)[starts],
+        "high": np.fmax.reduceat(df["high"].to_numpy(dtype=np.float64), starts),
+        "low": np.fmin.reduceat(df["low"].to_numpy(dtype=np.float64), starts),
+        "close": df["close"].to_numpy(dtype=np.float64)[ends],
+        "volume": np.add.reduceat(np.nan_to_num(df["volume"].to_numpy(dtype=np.float64)), starts),
+    })
+
+
+def parse_timeframes(value: str, default: int = 5) -> list[int]:
+    """'5' / '5,30' / '5/30/60' -> sorted unique supported timeframes (unsupported values -> 60)."""
+    out = []
+    for part in str(value or "").replace("/", ",").replace("+", ",").replace(" ", ",").split(","):
+        digits = "".join(ch for ch in part if ch.isdigit())
+        if not digits:
+            continue
+        tf = int(digits)
+        out.append(tf if tf in SUPPORTED_TIMEFRAMES else 60)
+    return sorted(set(out)) or [default]
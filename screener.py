@@ -0,0 +1,116 @@
+import os
+import warnings
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# 大自选池初筛：所有股票对齐成 (股票 × K 线) 的二维数组，一次向量化打分，只把靠前的股票送进完整的 抓取→图表→AI→PDF 流程
+
+
+class Panel(NamedTuple):
+    symbols: list
+    dates: np.ndarray   # (bars,) datetime64[ns]，公共时间轴
+    high: np.ndarray    # (symbols, bars) float32，缺失为 NaN
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.high, self.low, self.close, self.volume))
+
+
+def build_panel(frames: dict, bars: int) -> Panel:
+    """
+    Aligns each symbol's bars onto the union time axis (last `bars` timestamps); missing bars
+    (suspensions, gaps) stay NaN. One O(symbols x bars) pass, float32 to halve memory.
+    """
+    frames = {s: f for s, f in frames.items() if f is not None and not f.empty}
+    symbols = list(frames)
+    stamps = [f["date"].to_numpy(dtype="datetime64[ns]")[-bars:] for f in frames.values()]
+    # 全局最后 bars 个时间戳必然落在各股票各自的最后 bars 根之内，所以只需合并尾部
+    axis = np.unique(np.concatenate(stamps))[-bars:] if stamps else np.empty(0, dtype="datetime64[ns]")
+
+    cube = np.full((4, len(symbols), len(axis)), np.nan, dtype=np.float32)
+    for row, (f, dates) in enumerate(zip(frames.values(), stamps)):
+        keep = dates >= axis[0]
+        pos = np.searchsorted(axis, dates[keep])
+        for j, c in enumerate(("high", "low", "close", "volume")):
+            cube[j, row, pos] = f[c].to_numpy()[-len(dates):][keep]
+    return Panel(symbols, axis, *cube)
+
+
+def score_panel(panel: Panel, window: int = None, recent: int = None) -> pd.DataFrame:
+    """
+    Scores every symbol at once: the trading range is the `window` bars before the last `recent`
+    bars; the recent bars are checked for climax volume, springs/upthrusts, breakouts and volume
+    expansion. Returns one row per symbol sorted by score (desc) with the triggered reasons.
+    """
+    w = window or int(os.getenv("WYCKOFF_WINDOW", "60"))
+    k = recent or int(os.getenv("SCREEN_RECENT_BARS", "12"))
+    z_thr = float(os.getenv("WYCKOFF_CLIMAX_Z", "2.5"))
+    max_atr = float(os.getenv("WYCKOFF_RANGE_MAX_ATR", "10"))
+    n = len(panel.symbols)
+    if n == 0 or panel.close.shape[1] < w + k:
+        return pd.DataFrame({"symbol": panel.symbols, "score": np.zeros(n), "reasons": [""] * n})
+
+    h, l, c, v = panel.high, panel.low, panel.close, panel.volume
+    base, now = slice(-(w + k), -k), slice(-k, None)
+    # 全 NaN 行（整段停牌）会触发 "Mean of empty slice" 警告，结果为 NaN 即可
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        hi, lo = np.nanmax(h[:, base], axis=1), np.nanmin(l[:, base], axis=1)
+        atr = np.nanmean(h[:, base] - l[:, base], axis=1)
+        v_mean, v_std = np.nanmean(v[:, base], axis=1), np.nanstd(v[:, base], axis=1)
+        last = _last_valid(c)
+        rel_vol = np.nanmean(v[:, now], axis=1) / v_mean
+        vol_z = (np.nanmax(v[:, now], axis=1) - v_mean) / v_std
+        width = (hi - lo) / atr
+        recent_lo, recent_hi = np.nanmin(l[:, now], axis=1), np.nanmax(h[:, now], axis=1)
+
+    flags = {
+        "climax": vol_z >= z_thr,
+        "spring": (recent_lo < lo) & (last > lo),
+        "upthrust": (recent_hi > hi) & (last < hi),
+        "SOS": (last > hi) & (rel_vol >= 1.5),
+        "SOW": (last < lo) & (rel_vol >= 1.5),
+        "range": width <= max_atr,
+    }
+    weights = {"climax": 2.0, "spring": 2.0, "upthrust": 2.0, "SOS": 1.5, "SOW": 1.5, "range": 0.5}
+    score = np.clip(np.nan_to_num(rel_vol, nan=1.0), 0, 4) - 1
+    for name, mask in flags.items():
+        score = score + weights[name] * np.nan_to_num(mask, nan=False).astype(np.float64)
+
+    reasons = np.full(n, "", dtype=object)
+    for name, mask in flags.items():
+        mask = np.nan_to_num(mask, nan=False).astype(bool)
+        reasons[mask] = np.where(reasons[mask] == "", name, reasons[mask] + "+" + name)
+
+    out = pd.DataFrame({
+        "symbol": panel.symbols,
+        "score": np.round(score, 2),
+        "rel_vol": np.round(rel_vol, 2),
+        "vol_z": np.round(vol_z, 2),
+        "width_atr": np.round(width, 1),
+        "reasons": reasons,
+    })
+    return out.sort_values("score", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def select(scores: pd.DataFrame, top_n: int = None, min_score: float = None) -> list:
+    """Symbols scoring >= min_score, at most top_n of them (highest first)."""
+    top_n = top_n if top_n is not None else int(os.getenv("SCREEN_TOP_N", "20"))
+    min_score = min_score if min_score is not None else float(os.getenv("SCREEN_MIN_SCORE", "2"))
+    passed = scores[scores["score"] >= min_score]
+    return passed["symbol"].head(top_n).tolist() if top_n > 0 else passed["symbol"].tolist()
+
+
+def _last_valid(a: np.ndarray) -> np.ndarray:
+    """Last non-NaN value per row (NaN if the row is empty)."""
+    valid = ~np.isnan(a)
+    idx = a.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    out = a[np.arange(len(a)), idx]
+    out[~valid.any(axis=1)] = np.nan
+    return out
+
@@ -0,0 +1,267 @@
+import csv
+import os
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Iterable, Optional
+
+# A 股连续竞价时段（分钟，自 00:00 起）：上午 09:30-11:30，下午 13:00-15:00
+AM_OPEN, AM_CLOSE = 9 * 60 + 30, 11 * 60 + 30
+PM_OPEN, PM_CLOSE = 13 * 60, 15 * 60
+AM_MINUTES = AM_CLOSE - AM_OPEN
+SESSION_MINUTES = AM_MINUTES + (PM_CLOSE - PM_OPEN)
+
+_BJ_TZ = timezone(timedelta(hours=8))
+_CACHE_TTL = timedelta(days=7)
+
+
+def _minute_of_session(t: datetime) -> int:
+    """Clock time -> trading minutes since 09:30, clamped to [0, 240] (lunch break -> 120)."""
+    mod = t.hour * 60 + t.minute + t.second / 60.0
+    if mod <= AM_OPEN:
+        return 0
+    if mod <= AM_CLOSE:
+        return int(mod - AM_OPEN)
+    if mod <= PM_OPEN:
+        return AM_MINUTES
+    if mod <= PM_CLOSE:
+        return int(mod - PM_OPEN) + AM_MINUTES
+    return SESSION_MINUTES
+
+
+def _clock_of_session(d: date, minute: int) -> datetime:
+    clock = AM_OPEN + minute if minute <= AM_MINUTES else PM_OPEN + minute - AM_MINUTES
+    return datetime.combine(d, dtime(clock // 60, clock % 60))
+
+
+class TradeCalendar:
+    """
+    Sorted trading-day index loaded once per process.
+    Queries bisect over day ordinals (stdlib only, so the schedule gate stays cheap).
+    An empty calendar degrades to the weekday heuristic.
+    """
+
+    def __init__(self, days: Iterable[date]):
+        self._ordinals = sorted({d.toordinal() for d in days})
+
+    def __len__(self) -> int:
+        return len(self._ordinals)
+
+    def _covers(self, d: date) -> bool:
+        return self._ordinals[0] <= d.toordinal() <= self._ordinals[-1]
+
+    # ---- scalar lookups ----
+
+    def is_trading_day(self, d: date) -> bool:
+        if isinstance(d, datetime):
+            d = d.date()
+        if not self._ordinals:
+            return d.weekday() < 5
+        o = d.toordinal()
+        i = bisect_left(self._ordinals, o)
+        return i < len(self._ordinals) and self._ordinals[i] == o
+
+    def prev_trading_day(self, d: date, n: int = 1) -> Optional[date]:
+        """n-th trading day strictly before d; None when d or the answer lies outside the calendar."""
+        if n < 1:
+            raise ValueError(f"n must be >= 1, got {n}")
+        if isinstance(d, datetime):
+            d = d.date()
+        if not self._ordinals:
+            while n > 0:
+                d -= timedelta(days=1)
+                if d.weekday() < 5:
+                    n -= 1
+            return d
+        i = bisect_left(self._ordinals, d.toordinal()) - n
+        if i < 0 or not self._covers(d):
+            return None
+        return date.fromordinal(self._ordinals[i])
+
+    def next_trading_day(self, d: date, n: int = 1) -> Optional[date]:
+        """n-th trading day strictly after d; None when d or the answer lies outside the calendar."""
+        if n < 1:
+            raise ValueError(f"n must be >= 1, got {n}")
+        if isinstance(d, datetime):
+            d = d.date()
+        if not self._ordinals:
+            while n > 0:
+                d += timedelta(days=1)
+                if d.weekday() < 5:
+                    n -= 1
+            return d
+        i = bisect_right(self._ordinals, d.toordinal()) + n - 1
+        if i >= len(self._ordinals) or not self._covers(d):
+            return None
+        return date.fromordinal(self._ordinals[i])
+
+    def trading_days_between(self, start: date, end: date) -> list[date]:
+        """Trading days in [start, end]."""
+        if not self._ordinals:
+            out, d = [], start
+            while d <= end:
+                if d.weekday() < 5:
+                    out.append(d)
+                d += timedelta(days=1)
+            return out
+        lo = bisect_left(self._ordinals, start.toordinal())
+        hi = bisect_right(self._ordinals, end.toordinal())
+        return [date.fromordinal(o) for o in self._ordinals[lo:hi]]
+
+    def _session_position(self, t: datetime) -> tuple[int, int]:
+        """(trading-day index, minute within session) — non-trading days map to the next day's open."""
+        d = t.date()
+        if self.is_trading_day(d):
+            idx = self._day_index(d)
+            return idx, _minute_of_session(t)
+        # 非交易日的插入位置即下一交易日的序号（日历末尾之后同样成立）
+        return self._day_index(d), 0
+
+    def _day_index(self, d: date) -> int:
+        if self._ordinals:
+            return bisect_left(self._ordinals, d.toordinal())
+        # 工作日近似：以周序号计算
+        o = d.toordinal() - 1  # 0001-01-01 是周一
+        return (o // 7) * 5 + min(o % 7, 5)
+
+    def trading_minutes_between(self, t0: datetime, t1: datetime) -> int:
+        """Continuous-auction minutes in (t0, t1]; negative if t1 < t0."""
+        i0, m0 = self._session_position(t0)
+        i1, m1 = self._session_position(t1)
+        return (i1 - i0) * SESSION_MINUTES + (m1 - m0)
+
+    def last_completed_bar_end(self, now: datetime, tf_min: int) -> datetime:
+        """End time (naive Beijing) of the last bar of tf_min minutes that has closed by `now`."""
+        now = now.replace(tzinfo=None)
+        d = now.date()
+        if not self.is_trading_day(d) or now.hour * 60 + now.minute < AM_OPEN:
+            return _clock_of_session(prev_trading_day_or_weekday(self, d), SESSION_MINUTES)
+        m = _minute_of_session(now)
+        return _clock_of_session(d, (m // tf_min) * tf_min)
+
+
+# 日历覆盖不到时（如跨年后日历尚未刷新）退化为工作日推算
+_WEEKDAYS = TradeCalendar([])
+
+
+def prev_trading_day_or_weekday(cal: TradeCalendar, d: date, n: int = 1) -> date:
+    return cal.prev_trading_day(d, n) or _WEEKDAYS.prev_trading_day(d, n)
+
+
+def next_trading_day_or_weekday(cal: TradeCalendar, d: date, n: int = 1) -> date:
+    return cal.next_trading_day(d, n) or _WEEKDAYS.next_trading_day(d, n)
+
+
+def session_minutes(dates):
+    """
+    Trading minutes elapsed since 09:30 for bar-end timestamps (09:35 -> 5, 11:30 -> 120,
+    13:05 -> 125, 15:00 -> 240). Timestamps outside the sessions map to -1.
+    """
+    import numpy as np
+    d = np.asarray(dates, dtype="datetime64[m]")
+    mod = (d - d.astype("datetime64[D]")).astype(np.int64)
+    out = np.full(mod.shape, -1, dtype=np.int64)
+    am = (mod >= AM_OPEN) & (mod <= AM_CLOSE)
+    pm = (mod > PM_OPEN) & (mod <= PM_CLOSE)
+    out[am] = mod[am] - AM_OPEN
+    out[pm] = mod[pm] - PM_OPEN + AM_MINUTES
+    return out
+
+
+def session_clock(days, minutes):
+    """Inverse of session_minutes: (trading day, trading minute) -> bar-end datetime64[ns]."""
+    import numpy as np
+    minutes = np.asarray(minutes, dtype=np.int64)
+    clock = np.where(minutes <= AM_MINUTES, AM_OPEN + minutes, PM_OPEN + minutes - AM_MINUTES)
+    base = np.asarray(days, dtype="datetime64[D]").astype("datetime64[m]")
+    return (base + clock.astype("timedelta64[m]")).astype("datetime64[ns]")
+
+
+# ==========================================
+# 加载：本地缓存 (7 天 TTL) -> AkShare 新浪交易日历 -> 工作日退化
+# ==========================================
+
+def calendar_cache_path() -> str:
+    os.makedirs("data", exist_ok=True)
+    return os.path.join("data", "trade_calendar_sina.csv")
+
+
+def _parse_day(v: str) -> Optional[date]:
+    v = v.strip()
+    try:
+        if re.fullmatch(r"\d{8}", v):
+            return date(int(v[0:4]), int(v[4:6]), int(v[6:8]))
+        return date.fromisoformat(v[:10])
+    except ValueError:
+        return None
+
+
+def _read_cache(path: str) -> list[date]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return []
+        col = header.index("date") if "date" in header else 0
+        out = []
+        for row in reader:
+            if len(row) > col:
+                d = _parse_day(row[col])
+                if d:
+                    out.append(d)
+        return out
+
+
+def _fetch_remote() -> list[date]:
+    import akshare as ak
+    cal = ak.tool_trade_date_hist_sina()
+    for c in ("trade_date", "日期", "date"):
+        if c in cal.columns:
+            col = c
+            break
+    else:
+        col = cal.columns[0]
+    return [d for d in (_parse_day(str(v)) for v in cal[col].dropna().tolist()) if d]
+
+
+def load_trade_calendar(cache_path: Optional[str] = None) -> TradeCalendar:
+    cache_path = cache_path or calendar_cache_path()
+    try:
+        if os.path.exists(cache_path):
+            mtime = datetime.fromtimestamp(os.path.getmtime(cache_path), _BJ_TZ)
+            if (datetime.now(_BJ_TZ) - mtime) < _CACHE_TTL:
+                days = _read_cache(cache_path)
+                if days:
+                    return TradeCalendar(days)
+    except Exception:
+        pass
+
+    try:
+        days = sorted(set(_fetch_remote()))
+        try:
+            with open(cache_path, "w", encoding="utf-8", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(["date"])
+                w.writerows([d.isoformat()] for d in days)
+        except Exception:
+            pass
+        return TradeCalendar(days)
+    except Exception as e:
+        # Worst-case fallback: weekday heuristic (may run on holidays)
+        print(f"    ⚠️ 交易日历获取失败，退化为工作日判断: {e}", flush=True)
+        return TradeCalendar([])
+
+
+_CALENDAR: Optional[TradeCalendar] = None
+_CALENDAR_LOCK = threading.Lock()
+
+
+def get_trade_calendar() -> TradeCalendar:
+    """Process-wide calendar, loaded from disk/network at most once."""
+    global _CALENDAR
+    if _CALENDAR is None:
+        with _CALENDAR_LOCK:
+            if _CALENDAR is None:
+                _CALENDAR = load_trade_calendar()
+    return _CALENDAR
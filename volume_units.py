@@ -0,0 +1,138 @@
+import json
+import math
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# 数据源成交量 -> 股 的候选倍数（AkShare 分钟线通常为“手”，即 ×100）
+_CANDIDATES = (1.0, 100.0, 1000.0, 0.01, 0.001)
+_TOL = 0.25
+# 无重叠参照时的启发式结果只给低置信度，之后有重叠数据即会被覆盖
+_HEURISTIC_CONFIDENCE = 0.3
+# 置信度达到该值的因子直接使用，不再计算重叠；超过 VOLUME_UNIT_REVALIDATE_DAYS 天未复核时再校验一次
+_TRUSTED_CONFIDENCE = 0.8
+
+
+def _match_factor(ratio: float) -> Optional[float]:
+    for c in _CANDIDATES:
+        if c * (1 - _TOL) <= ratio <= c * (1 + _TOL):
+            return c
+    return None
+
+
+def _overlap_factor(df_ref: pd.DataFrame, df_src: pd.DataFrame) -> Optional[tuple[float, float, int]]:
+    """(factor, confidence, samples) from bars present in both frames; df_ref is in shares."""
+    if df_ref is None or df_src is None or df_ref.empty or df_src.empty:
+        return None
+    d_ref = df_ref["date"].to_numpy(dtype="datetime64[ns]")
+    d_src = df_src["date"].to_numpy(dtype="datetime64[ns]")
+    _, i_ref, i_src = np.intersect1d(d_ref, d_src, return_indices=True)
+    if len(i_ref) < 10:
+        return None
+    i_ref, i_src = i_ref[-200:], i_src[-200:]
+    v_ref = df_ref["volume"].to_numpy(dtype=np.float64)[i_ref]
+    v_src = df_src["volume"].to_numpy(dtype=np.float64)[i_src]
+    ok = (v_ref > 0) & (v_src > 0)
+    if ok.sum() < 10:
+        return None
+    ratios = v_ref[ok] / v_src[ok]
+    factor = _match_factor(float(np.median(ratios)))
+    if factor is None:
+        return None
+    confidence = float((np.abs(ratios / factor - 1) <= _TOL).mean())
+    return factor, confidence, int(ok.sum())
+
+
+def _heuristic_factor(df_src: pd.DataFrame) -> float:
+    v = df_src["volume"].dropna()
+    if len(v) < 50:
+        return 100.0
+    return 1.0 if float((v % 100 == 0).mean()) > 0.9 else 100.0
+
+
+class VolumeUnitCalibrator:
+    """
+    Per (symbol, source) lots-vs-shares factor with a confidence score, persisted to
+    data/volume_units.json. A trusted, recently checked factor is applied as one in-place
+    multiply without looking at the reference; otherwise the overlap with the reference is
+    computed and recalibrates the factor when it disagrees.
+    """
+
+    def __init__(self, path: str = os.path.join("data", "volume_units.json")):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._table: dict = {}
+        try:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self._table = json.load(f) or {}
+        except Exception:
+            self._table = {}
+
+    def get(self, symbol: str, source: str) -> Optional[dict]:
+        return (self._table.get(symbol) or {}).get(source)
+
+    def _needs_check(self, entry: Optional[dict]) -> bool:
+        if entry is None or float(entry.get("confidence", 0)) < _TRUSTED_CONFIDENCE:
+            return True
+        try:
+            checked = datetime.strptime(entry.get("updated", ""), "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            return True
+        return (datetime.now() - checked).days >= float(os.getenv("VOLUME_UNIT_REVALIDATE_DAYS", "7"))
+
+    def normalize(self, symbol: str, source: str, df: pd.DataFrame, df_ref: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Scales df['volume'] to shares in place and returns df."""
+        if df is None or df.empty:
+            return df
+        with self._lock:
+            entry = self.get(symbol, source)
+            factor = None if self._needs_check(entry) else float(entry["factor"])
+        if factor is not None:
+            if factor != 1.0:
+                df["volume"] *= factor
+            return df
+
+        observed = _overlap_factor(df_ref, df)
+        with self._lock:
+            entry = self.get(symbol, source)
+            if observed is not None:
+                factor, confidence, samples = observed
+                if entry is None or not math.isclose(entry["factor"], factor, rel_tol=_TOL):
+                    if entry is not None:
+                        print(f"    🔁 [{symbol}] {source} 成交量单位重新校准: ×{entry['factor']:g} -> ×{factor:g}", flush=True)
+                    entry = {"factor": factor, "confidence": round(confidence, 3), "samples": samples}
+                else:
+                    entry["samples"] = int(entry.get("samples", 0)) + samples
+                    entry["confidence"] = round(max(float(entry.get("confidence", 0)), confidence), 3)
+                self._put(symbol, source, entry)
+            elif entry is None:
+                entry = {"factor": _heuristic_factor(df), "confidence": _HEURISTIC_CONFIDENCE, "samples": 0}
+                self._put(symbol, source, entry)
+            factor = float(entry["factor"])
+
+        if factor != 1.0:
+            df["volume"] *= factor
+        return df
+
+    def _put(self, symbol: str, source: str, entry: dict) -> None:
+        entry["updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._table.setdefault(symbol, {})[source] = entry
+        self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(self._table, f, ensure_ascii=False, indent=2)
+                self._dirty = False
+            except Exception as e:
+                print(f"    ⚠️ 成交量单位缓存写入失败: {e}", flush=True)
@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 候选事件（规则判定，仅作提示，最终由模型结合 K 线确认）
+EVENT_NAMES = {
+    "SC": "selling climax candidate",
+    "BC": "buying climax candidate",
+    "Spring": "spring: broke range low, closed back inside",
+    "UT": "upthrust: broke range high, closed back inside",
+    "Test": "low-volume test of range low",
+    "SOS": "close above range high on volume",
+    "SOW": "close below range low on volume",
+    "Absorb": "effort without result: high volume, narrow spread",
+    "NoEffort": "result without effort: wide spread, low volume",
+}
+
+
+def _prior(a: np.ndarray, w: int, fn) -> np.ndarray:
+    """fn over the previous w values (excluding the current bar); NaN until w bars exist."""
+    out = np.full(len(a), np.nan)
+    if len(a) > w:
+        out[w:] = fn(sliding_window_view(a[:-1], w), axis=1)
+    return out
+
+
+def detect_events(df: pd.DataFrame, window: int = None) -> tuple[pd.DataFrame, dict]:
+    """
+    One vectorized pass over the frame: rolling trading-range bounds, ATR, relative volume/spread,
+    close location, and rule-based Wyckoff candidates. Returns (events, summary) where events has
+    date, event, close, rel_vol, rel_spread, clv for bars that triggered any rule.
+    """
+    w = window or int(os.getenv("WYCKOFF_WINDOW", "60"))
+    empty = pd.DataFrame(columns=["date", "event", "close", "rel_vol", "rel_spread", "clv"])
+    if len(df) <= w:
+        return empty, {}
+
+    h = df["high"].to_numpy(dtype=np.float64)
+    l = df["low"].to_numpy(dtype=np.float64)
+    c = df["close"].to_numpy(dtype=np.float64)
+    v = np.nan_to_num(df["volume"].to_numpy(dtype=np.float64))
+    prev_c = np.r_[c[0], c[:-1]]
+
+    spread = h - l
+    tr = np.maximum(spread, np.maximum(np.abs(h - prev_c), np.abs(l - prev_c)))
+    range_hi = _prior(h, w, np.max)
+    range_lo = _prior(l, w, np.min)
+    atr = _prior(tr, w, np.mean)
+    vol_mean = _prior(v, w, np.mean)
+    vol_std = _prior(v, w, np.std)
+    spread_mean = _prior(spread, w, np.mean)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_vol = v / vol_mean
+        vol_z = (v - vol_mean) / vol_std
+        rel_spread = spread / spread_mean
+        clv = np.where(spread > 0, (c - l) / spread, 0.5)
+        trend = c / np.r_[np.full(w, np.nan), c[:-w]] - 1
+        in_range = (range_hi - range_lo) <= float(os.getenv("WYCKOFF_RANGE_MAX_ATR", "10")) * atr
+
+    z = float(os.getenv("WYCKOFF_CLIMAX_Z", "2.5"))
+    broke_lo, broke_hi = l < range_lo, h > range_hi
+    sc = broke_lo & (vol_z >= z) & (rel_spread >= 1.5) & (clv >= 0.3) & (trend < 0)
+    bc = broke_hi & (vol_z >= z) & (rel_spread >= 1.5) & (clv <= 0.7) & (trend > 0)
+    rules = {
+        "SC": sc,
+        "BC": bc,
+        "Spring": broke_lo & (c > range_lo) & in_range & ~sc,
+        "UT": broke_hi & (c < range_hi) & in_range & ~bc,
+        "Test": ~broke_lo & (l <= range_lo + 0.3 * atr) & (rel_vol <= 0.6),
+        "SOS": (c > range_hi) & (rel_vol >= 1.5) & ~bc,
+        "SOW": (c < range_lo) & (rel_vol >= 1.5) & ~sc,
+        "Absorb": (rel_vol >= 2.0) & (rel_spread <= 0.6),
+        "NoEffort": (rel_vol <= 0.5) & (rel_spread >= 1.8),
+    }
+
+    labels = np.full(len(df), "", dtype=object)
+    for name, mask in rules.items():
+        mask = np.nan_to_num(mask, nan=False).astype(bool)
+        labels[mask] = np.where(labels[mask] == "", name, labels[mask] + "+" + name)
+    hit = labels != ""
+    # 连续多根触发同一规则只保留第一根
+    idx = np.flatnonzero(hit)
+    if len(idx) > 1:
+        repeat = (labels[idx[1:]] == labels[idx[:-1]]) & (np.diff(idx) <= 3)
+        hit[idx[1:][repeat]] = False
+
+    events = pd.DataFrame({
+        "date": df["date"].to_numpy()[hit],
+        "event": labels[hit],
+        "close": c[hit],
+        "rel_vol": rel_vol[hit],
+        "rel_spread": rel_spread[hit],
+        "clv": clv[hit],
+    })
+
+    # 当前区间：含最新一根的最近 w 根
+    hi_now, lo_now = float(h[-w:].max()), float(l[-w:].min())
+    atr_now = float(np.nanmean(tr[-w:]))
+    summary = {
+        "window": w,
+        "range_high": hi_now,
+        "range_low": lo_now,
+        "width_atr": (hi_now - lo_now) / atr_now if atr_now > 0 else float("nan"),
+        "position": (c[-1] - lo_now) / (hi_now - lo_now) if hi_now > lo_now else 0.5,
+    }
+    return events, summary
+
+
+def format_events(events: pd.DataFrame, summary: dict, max_rows: int = None) -> str:
+    """Compact event table for the prompt (most recent max_rows events)."""
+    if not summary:
+        return ""
+    max_rows = max_rows or int(os.getenv("WYCKOFF_MAX_EVENTS", "40"))
+    legend = "; ".join(f"{k}={v}" for k, v in EVENT_NAMES.items())
+    lines = [
+        f"# Rule-based Wyckoff candidates (verify against the bars). Range = last {summary['window']} bars. {legend}.",
+        f"range_high={summary['range_high']:g}, range_low={summary['range_low']:g}, "
+        f"width={summary['width_atr']:.1f} ATR, last close at {summary['position'] * 100:.0f}% of range",
+        "time,event,close,vol_x,spread_x,clv",
+    ]
+    ev = events.tail(max_rows)
+    times = pd.to_datetime(ev["date"]).dt.strftime("%m-%d %H:%M").tolist()
+    for t, e, cl, rv, rs, cv in zip(times, ev["event"], ev["close"], ev["rel_vol"], ev["rel_spread"], ev["clv"]):
+        lines.append(f"{t},{e},{cl:g},{rv:.1f},{rs:.1f},{cv:.2f}")
+    return "\n".join(lines) + "\n"